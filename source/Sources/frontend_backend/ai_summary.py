@@ -3,7 +3,18 @@ import re
 from dotenv import load_dotenv
 import time
 import logging
-from mistralai import Mistral
+import asyncio
+import queue
+import ahocorasick
+import functools
+import hashlib
+import threading
+import datetime
+from collections import OrderedDict
+import httpx
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +29,217 @@ MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 # Cache duration in seconds (10 minutes)
 CACHE_DURATION = 600
 
+# The mistralai SDK is imported on first actual API use (it pulls in pydantic schemas)
+_MISTRAL_CLS = None
+
+# Shared Mistral client: its HTTP connection pool is kept alive across calls
+_MISTRAL_CLIENT = None
+
+def _get_mistral():
+    """Import and return the Mistral class on first use"""
+    global _MISTRAL_CLS
+    if _MISTRAL_CLS is None:
+        from mistralai import Mistral as _MISTRAL_CLS
+    return _MISTRAL_CLS
+
+def _get_mistral_client():
+    """Return the shared Mistral client, created on first use"""
+    global _MISTRAL_CLIENT
+    if _MISTRAL_CLIENT is None:
+        _MISTRAL_CLIENT = _get_mistral()(api_key=MISTRAL_API_KEY)
+    return _MISTRAL_CLIENT
+
+# After a Mistral API error, reformulations use the local fallback for this many seconds
+MISTRAL_FAILURE_BACKOFF = 30
+_mistral_retry_after = 0.0
+
+# A query whose Mistral reformulation was unusable uses the local fallback for this many seconds
+REFORMULATION_UNUSABLE_TTL = 30
+REFORMULATION_UNUSABLE_MAX_ENTRIES = 1024
+_reformulation_unusable_until = {}
+
+class UnusableReformulation(Exception):
+    """Mistral answered, but nothing usable could be extracted from the reformulation"""
+
+# Maximum number of concurrent Mistral requests (API rate limit)
+MAX_CONCURRENT_REQUESTS = 8
+
+# Maximum length of the section text sent to Mistral for a medicine summary
+SUMMARY_MAX_CHARS = 5000
+
+# Semantic cache: minimum cosine similarity for two queries to be considered equivalent
+SEMANTIC_CACHE_THRESHOLD = 0.85
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+# Persisted semantic cache entries expire after this many seconds (TTL index on ts)
+SEMANTIC_CACHE_TTL = 7 * 24 * 3600
+SEMANTIC_CACHE_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Precompiled patterns used by clean_summary_format
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_WS_RE = re.compile(r'\n{3,}')
+
+# Tokenizer for the local reformulation fallback: words of 3+ letters or digits
+_TOKEN_RE = re.compile(r"[a-z0-9àâçéèêëîïôûùüÿñæœ]{3,}")
+
+# Dictionnaire de synonymes médicaux pour fallback
+# (valeurs figées en tuples : l'ordre d'expansion reste identique d'un processus à l'autre)
+_MEDICAL_SYNONYMS = {term: tuple(synonyms) for term, synonyms in {
+    'tete': ['cephalee', 'migraine', 'cranien', 'douleur', 'cephalalgies'],
+    'grippe': ['influenza', 'viral', 'infection', 'fievre'],
+    'fievre': ['pyrexie', 'hyperthermie', 'temperature'],
+    'respiration': ['dyspnee', 'asthme', 'bronchite', 'pulmonaire', 'toux'],
+    'ventre': ['abdomen', 'abdominal', 'gastrite'],
+    'migraine': ['cephalee', 'tete', 'cranien'],
+    'nausee': ['vomissement', 'digestif'],
+    'toux': ['expectorant', 'respiratoire', 'bronchite'],
+    'allergie': ['allergique', 'reaction', 'urticaire'],
+    'mal de tête': ['cephalee', 'migraine', 'cranien', 'douleur'],
+    'mal au ventre': ['abdomen', 'abdominal', 'gastrite', 'douleur'],
+}.items()}
+
+# Automate Aho-Corasick : trouve tous les termes (y compris multi-mots) en un seul parcours
+_SYNONYM_AUTOMATON = ahocorasick.Automaton()
+for _term, _synonyms in _MEDICAL_SYNONYMS.items():
+    _SYNONYM_AUTOMATON.add_word(_term, (_term, _synonyms))
+_SYNONYM_AUTOMATON.make_automaton()
+
+_STOPWORDS = frozenset({
+    'j\'ai', 'ai', 'je', 'me', 'ma', 'mon', 'mes', 'tu', 'te', 'ta', 'ton', 'tes',
+    'il', 'elle', 'elles', 'ils', 'leur', 'lui', 'nous', 'vous', 'et', 'ou', 'mais',
+    'car', 'donc', 'par', 'pour', 'avec', 'sans', 'sous', 'sur', 'dans', 'à', 'au', 'aux',
+    'un', 'une', 'des', 'du', 'la', 'le', 'les', 'de', 'que', 'qui', 'ce', 'ses', 'son',
+    'beaucoup', 'très', 'un peu', 'trop', 'assez', 'plus', 'moins', 'plutôt',
+    'depuis', 'jours', 'jour', 'nuit', 'semaine', 'mois', 'ans', 'an', 'heure',
+    'souffre', 'souffrir', 'problème', 'trouble', 'suis', 'est', 'avoir', 
+    'quoi', 'comment', 'pourquoi', 'quand', 'où', 'ça', 'pas', 'ne', 'ni'
+})
+
+_cache_encoder = None
+_cache_encoder_lock = threading.Lock()
+
+def _get_cache_encoder():
+    """Load the sentence-transformer used by the semantic caches on first use"""
+    global _cache_encoder
+    if _cache_encoder is None:
+        with _cache_encoder_lock:
+            if _cache_encoder is None:
+                from sentence_transformers import SentenceTransformer
+                _cache_encoder = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+    return _cache_encoder
+
+class SemanticCache:
+    """
+    Cache of LLM answers keyed by query meaning rather than exact text.
+    
+    Queries are embedded and normalized, so a dot product against the stored
+    matrix gives the cosine similarity. A hit requires the same exact key
+    (e.g. the set of documents a summary is based on) and a similarity above
+    the threshold. Entries are persisted in a MongoDB collection and reloaded
+    the first time the cache is attached to a database.
+    """
+    
+    def __init__(self, collection_name, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Ring buffer: rows are preallocated on the first insert, the oldest one is overwritten
+        self._matrix = None
+        self._keys = [None] * max_entries
+        self._results = [None] * max_entries
+        self._count = 0
+        self._next = 0
+        self._collection = None
+        self._lock = threading.Lock()
+    
+    def attach(self, db):
+        """Bind the cache to a MongoDB database and load persisted entries (once)"""
+        if db is None or self._collection is not None:
+            return
+        with self._lock:
+            if self._collection is not None:
+                return
+            self._collection = db[self.collection_name]
+            try:
+                # Entries written before ts became a date (epoch seconds) are converted so they expire too
+                self._collection.update_many(
+                    {"ts": {"$type": "number"}},
+                    [{"$set": {"ts": {"$toDate": {"$multiply": ["$ts", 1000]}}}}]
+                )
+                self._collection.create_index("ts", expireAfterSeconds=SEMANTIC_CACHE_TTL)
+                entries = list(self._collection.find({}, {"_id": 0}).sort("ts", -1).limit(self.max_entries))
+                # Oldest first, so that they are the first to be overwritten
+                for entry in reversed(entries):
+                    self._append(np.frombuffer(entry['embedding'], dtype=np.float32), entry.get('key', ''), entry['result'])
+                logger.info(f"Semantic cache '{self.collection_name}': {len(entries)} entries loaded")
+            except Exception as e:
+                logger.error(f"Error loading semantic cache '{self.collection_name}': {e}")
+    
+    def _append(self, embedding, key, result):
+        """Write an entry in the next ring buffer slot (caller holds the lock)"""
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+        self._matrix[self._next] = embedding
+        self._keys[self._next] = key
+        self._results[self._next] = result
+        self._next = (self._next + 1) % self.max_entries
+        self._count = min(self._count + 1, self.max_entries)
+    
+    def encode(self, query):
+        """Return the normalized float32 embedding of a query"""
+        embedding = _get_cache_encoder().encode(query, normalize_embeddings=True)
+        return np.asarray(embedding, dtype=np.float32)
+    
+    def lookup(self, embedding, key=''):
+        """Return the cached result closest to embedding for this key, or None"""
+        with self._lock:
+            if not self._count:
+                return None
+            similarities = self._matrix[:self._count] @ embedding
+            for index in np.argsort(similarities)[::-1]:
+                if similarities[index] < self.threshold:
+                    break
+                if self._keys[index] == key:
+                    return self._results[index]
+        return None
+    
+    def add(self, embedding, result, key=''):
+        """Store a result and persist it if a database is attached"""
+        with self._lock:
+            self._append(embedding, key, result)
+        if self._collection is not None:
+            try:
+                self._collection.insert_one({
+                    "embedding": Binary(embedding.tobytes()),
+                    "key": key,
+                    "result": result,
+                    "ts": datetime.datetime.now(datetime.timezone.utc)
+                })
+            except Exception as e:
+                logger.error(f"Error saving semantic cache entry: {e}")
+
+reformulation_cache = SemanticCache("reformulation_cache")
+rag_answer_cache = SemanticCache("rag_answer_cache")
+
+def _semantic_lookup(cache, db, query, key=''):
+    """
+    Look a query up in a semantic cache
+    
+    Returns:
+        tuple: (cached result or None, query embedding or None if encoding failed)
+    """
+    try:
+        cache.attach(db)
+        embedding = cache.encode(query)
+        return cache.lookup(embedding, key), embedding
+    except Exception as e:
+        logger.error(f"Semantic cache unavailable: {e}")
+        return None, None
+
+def _semantic_store(cache, embedding, result, key=''):
+    """Store a result in a semantic cache when the query could be encoded"""
+    if embedding is not None:
+        cache.add(embedding, result, key)
+
 def clean_summary_format(text):
     """
     Clean and format the summary text from Mistral.
@@ -30,57 +252,39 @@ def clean_summary_format(text):
         str: Cleaned text ready for HTML display
     """
     # Remove markdown code blocks
-    text = text.replace("```html", "").replace("```", "").strip()
+    if "```" in text:
+        text = text.replace("```html", "").replace("```", "")
+    text = text.strip()
     
-    # Remove HTML comments
-    import re
-    text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL)
+    # Remove HTML comments (substring checks skip the regex engine on clean answers)
+    if "<!--" in text:
+        text = _COMMENT_RE.sub('', text)
     
     # Clean up excessive whitespace
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    if "\n\n\n" in text:
+        text = _WS_RE.sub('\n\n', text)
     
     return text.strip()
 
-def call_mistral_reformulate(user_query):
-    """Reformule avec Mistral + expansion de synonymes médicaux"""
-    
-    # Dictionnaire de synonymes médicaux pour fallback
-    medical_synonyms = {
-        'tete': ['cephalee', 'migraine', 'cranien', 'douleur', 'cephalalgies'],
-        'grippe': ['influenza', 'viral', 'infection', 'fievre'],
-        'fievre': ['pyrexie', 'hyperthermie', 'temperature'],
-        'respiration': ['dyspnee', 'asthme', 'bronchite', 'pulmonaire', 'toux'],
-        'ventre': ['abdomen', 'abdominal', 'gastrite'],
-        'migraine': ['cephalee', 'tete', 'cranien'],
-        'nausee': ['vomissement', 'digestif'],
-        'toux': ['expectorant', 'respiratoire', 'bronchite'],
-        'allergie': ['allergique', 'reaction', 'urticaire'],
-    }
-    
-    stopwords = {
-        'j\'ai', 'ai', 'je', 'me', 'ma', 'mon', 'mes', 'tu', 'te', 'ta', 'ton', 'tes',
-        'il', 'elle', 'elles', 'ils', 'leur', 'lui', 'nous', 'vous', 'et', 'ou', 'mais',
-        'car', 'donc', 'par', 'pour', 'avec', 'sans', 'sous', 'sur', 'dans', 'à', 'au', 'aux',
-        'un', 'une', 'des', 'du', 'la', 'le', 'les', 'de', 'que', 'qui', 'ce', 'ses', 'son',
-        'beaucoup', 'très', 'un peu', 'trop', 'assez', 'plus', 'moins', 'plutôt',
-        'depuis', 'jours', 'jour', 'nuit', 'semaine', 'mois', 'ans', 'an', 'heure',
-        'souffre', 'souffrir', 'problème', 'trouble', 'suis', 'est', 'avoir', 
-        'quoi', 'comment', 'pourquoi', 'quand', 'où', 'ça', 'pas', 'ne', 'ni'
-    }
-    
-    if not MISTRAL_API_KEY:
-        # Fallback sans Mistral
-        words = user_query.lower().split()
-        expanded = set()
-        for word in words:
-            word_clean = word.strip('.,!?;:-')
-            if word_clean not in stopwords and len(word_clean) > 2:
-                expanded.add(word_clean)
-                if word_clean in medical_synonyms:
-                    expanded.update(medical_synonyms[word_clean])
-        return ' '.join(sorted(expanded)) if expanded else user_query
-    
-    prompt = f"""Tu es un assistant médical. Réforme cette question en mots-clés pour chercher des médicaments.
+def _expand_keywords(text):
+    """Mots-clés filtrés (sans stopwords) + synonymes médicaux, séparés par des espaces ('' si aucun)"""
+    text = text.lower()
+    # dict = ensemble ordonné : ordre d'insertion déterministe, sans tri
+    expanded = dict.fromkeys(t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS)
+    for end, (term, synonyms) in _SYNONYM_AUTOMATON.iter(text):
+        start = end - len(term) + 1
+        # Ignorer les correspondances au milieu d'un mot
+        if (start > 0 and text[start - 1].isalnum()) or (end + 1 < len(text) and text[end + 1].isalnum()):
+            continue
+        expanded.update(dict.fromkeys(synonyms))
+    return ' '.join(expanded)
+
+def _local_expand(user_query):
+    """Expansion locale (sans Mistral) : mots-clés filtrés + synonymes médicaux"""
+    return _expand_keywords(user_query) or user_query
+
+# Instructions fixes de reformulation, envoyées en message système (seule la question varie)
+_REFORMULATE_SYSTEM = """Tu es un assistant médical. Réforme la question de l'utilisateur en mots-clés pour chercher des médicaments.
 
 RÈGLES STRICTES:
 1. Enlève articles, pronoms, verbes inutiles (je, j'ai, la, le, avoir, est, etc.)
@@ -93,74 +297,132 @@ EXEMPLES:
 - "j'ai mal à la tête" → tete cephalee migraine douleur cranien
 - "j'ai la grippe" → grippe influenza viral fievre
 - "mal au ventre" → ventre abdomen douleur gastrite
-- "j'ai beaucoup de nausées" → nausee vomissement digestif
+- "j'ai beaucoup de nausées" → nausee vomissement digestif"""
+
+# Instructions fixes de la synthèse RAG
+_SUMMARIZE_SYSTEM = """Tu es un assistant médical. À partir de la question utilisateur et des documents médicaux trouvés, rédige une réponse synthétique, claire et adaptée à la question.
+
+INSTRUCTIONS DE FORMATAGE :
+- Réponds en français, en 1 à 3 paragraphes maximum.
+- Utilise uniquement du HTML simple (<p>, <strong>, <em>).
+- Mets en gras les termes médicaux importants.
+- Ne commence pas par "Voici les documents" ou "D'après les documents".
+- Sois synthétique, informatif et accessible."""
 
-Question: {user_query}
-Mots-clés:"""
+# Fixed instructions of the medicine summary
+_SUMMARY_SYSTEM = """Tu rédiges des résumés de médicaments en français.
+
+Le résumé doit inclure:
+1. Les utilisations principales de ce médicament
+2. Comment il fonctionne en termes simples
+3. Mention brève des effets secondaires courants le cas échéant
+4. Précautions d'emploi importantes
+
+INSTRUCTIONS DE FORMATAGE IMPORTANTES:
+- Utilise UNIQUEMENT du HTML simple (pas de Markdown)
+- Format: paragraphes avec balises <p> </p>
+- Pour le texte en gras, utilise <strong> </strong>
+- Pour l'italique, utilise <em> </em>
+- Mets en gras (<strong>) les noms de maladies, symptômes et termes médicaux importants
+- Mets également en gras les précautions d'emploi cruciales
+- Maximum 3-4 paragraphes
+- Ton: Informatif et accessible, adapté à un large public
+- N'UTILISE PAS de balises de code comme ```html au début ou à la fin"""
+
+@functools.lru_cache(maxsize=1024)
+def _reformulate_cached(user_query):
+    """
+    Reformulation Mistral d'une question exacte, mémorisée en LRU.
+    Lève une exception si l'API échoue ou UnusableReformulation si la réponse est inutilisable
+    (les exceptions ne sont pas mémorisées).
+    """
+    # Une question proche a déjà été reformulée : pas besoin d'appeler Mistral
+    cached, query_embedding = _semantic_lookup(reformulation_cache, None, user_query)
+    if cached is not None:
+        logger.debug(f"Reformulation (cache): '{user_query}' → '{cached}'")
+        return cached
     
-    try:
-        client = Mistral(api_key=MISTRAL_API_KEY)
-        response = client.chat.complete(
-            model="mistral-small-2503",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=50
-        )
-        reformulated = response.choices[0].message.content.strip().lower()
-        
-        # Nettoyage
-        reformulated = reformulated.replace('"', '').replace("'", '').replace(':', '').replace(',', ' ')
-        
-        # Enlever les lignes parasites
-        for line in reformulated.splitlines():
-            line = line.strip()
-            if line and not any(x in line for x in ['question', 'reponse', 'exemple', 'mots']):
-                # Filtrer stopwords
-                words = line.split()
-                cleaned = [w.strip() for w in words if w.strip() not in stopwords and len(w.strip()) > 2]
-                
-                # Ajouter synonymes pour chaque mot
-                expanded = set(cleaned)
-                for word in cleaned:
-                    if word in medical_synonyms:
-                        expanded.update(medical_synonyms[word])
-                
-                if expanded:
-                    result = ' '.join(sorted(expanded))
-                    print(f"DEBUG Reformulation (Mistral): '{user_query}' → '{result}'")
-                    return result
-        
-        # Fallback si Mistral retourne rien
-        raise Exception("Mistral returned empty")
-        
-    except Exception as e:
-        logger.error(f"Erreur Mistral: {e}")
+    response = _get_mistral_client().chat.complete(
+        model="mistral-small-2503",
+        messages=[
+            {"role": "system", "content": _REFORMULATE_SYSTEM},
+            {"role": "user", "content": user_query}
+        ],
+        temperature=0.2,
+        max_tokens=50,
+        # Seule la première ligne de mots-clés est utilisée : arrêter la génération au-delà
+        stop=["\n\n", "Question:"]
+    )
+    reformulated = response.choices[0].message.content.strip().lower()
+    
+    # Nettoyage
+    reformulated = reformulated.replace('"', '').replace("'", '').replace(':', '').replace(',', ' ')
+    
+    # Enlever les lignes parasites
+    for line in reformulated.splitlines():
+        line = line.strip()
+        if line and not any(x in line for x in ['question', 'reponse', 'exemple', 'mots']):
+            # Filtrer stopwords et ajouter les synonymes
+            result = _expand_keywords(line)
+            if result:
+                print(f"DEBUG Reformulation (Mistral): '{user_query}' → '{result}'")
+                _semantic_store(reformulation_cache, query_embedding, result)
+                return result
+    
+    # Mistral n'a rien retourné d'exploitable
+    raise UnusableReformulation(user_query)
+
+def call_mistral_reformulate(user_query, db=None):
+    """Reformule avec Mistral + expansion de synonymes médicaux"""
+    global _mistral_retry_after
+    
+    if not MISTRAL_API_KEY:
+        # Fallback sans Mistral
+        return _local_expand(user_query)
+    
+    result = None
+    now = time.monotonic()
+    # Mistral a échoué récemment (ou n'a rien donné d'exploitable pour cette question) :
+    # passer directement au fallback sans repayer l'appel
+    if now >= _mistral_retry_after and now >= _reformulation_unusable_until.get(user_query, 0):
+        try:
+            reformulation_cache.attach(db)
+            result = _reformulate_cached(user_query)
+        except UnusableReformulation:
+            if len(_reformulation_unusable_until) >= REFORMULATION_UNUSABLE_MAX_ENTRIES:
+                # Oublier les entrées expirées (ou toutes si aucune ne l'est) pour borner la taille
+                expired = [q for q, until in list(_reformulation_unusable_until.items()) if until <= now]
+                for q in expired or list(_reformulation_unusable_until):
+                    _reformulation_unusable_until.pop(q, None)
+            _reformulation_unusable_until[user_query] = now + REFORMULATION_UNUSABLE_TTL
+        except Exception as e:
+            logger.error(f"Erreur Mistral: {e}")
+            _mistral_retry_after = time.monotonic() + MISTRAL_FAILURE_BACKOFF
+    
+    if result is None:
         # Fallback avec expansion locale
-        words = user_query.lower().split()
-        expanded = set()
-        for word in words:
-            word_clean = word.strip('.,!?;:-')
-            if word_clean not in stopwords and len(word_clean) > 2:
-                expanded.add(word_clean)
-                if word_clean in medical_synonyms:
-                    expanded.update(medical_synonyms[word_clean])
-        result = ' '.join(sorted(expanded)) if expanded else user_query
+        result = _local_expand(user_query)
         print(f"DEBUG Reformulation (fallback): '{user_query}' → '{result}'")
-        return result
+    return result
 
-def call_mistral_summarize(user_query, docs):
+def format_html_answer(text):
     """
-    Utilise Mistral pour générer une réponse synthétique à partir de documents trouvés (RAG).
+    Nettoie une réponse Mistral et garantit qu'elle est encapsulée dans des paragraphes HTML.
     Args:
-        user_query (str): Question utilisateur
-        docs (list): Liste de documents (dict) pertinents trouvés
+        text (str): Texte brut renvoyé par Mistral
     Returns:
-        str: Réponse synthétique générée par l'IA
+        str: Texte prêt pour l'affichage HTML
     """
-    if not MISTRAL_API_KEY:
-        return "<p>Erreur : Clé API Mistral manquante.</p>"
+    text = clean_summary_format(text)
+    if not text.strip().startswith('<p>'):
+        text = "<p>" + text.replace("\n\n", "</p><p>") + "</p>"
+        text = text.replace("<p></p>", "")
+    return text
+
+def _summarize_request(user_query, docs):
+    """Construit les paramètres de la requête Mistral pour la synthèse RAG."""
     # Préparer un contexte court à partir des documents (extraits, titres)
-    context = ""
+    context_parts = []
     for i, doc in enumerate(docs):
         title = doc.get('title', f'Document {i+1}')
         laboratoire = doc.get('medicine_details', {}).get('laboratoire', '')
@@ -176,161 +438,341 @@ def call_mistral_summarize(user_query, docs):
                             break
                     if extrait:
                         break
-        context += f"\n- Titre : {title}\n  Laboratoire : {laboratoire}\n  Substances : {', '.join(substances)}\n  Extrait : {extrait}"
-    # Prompt pour la génération de réponse
-    prompt = f"""
-    Tu es un assistant médical. À partir de la question utilisateur et des documents médicaux trouvés ci-dessous, rédige une réponse synthétique, claire et adaptée à la question.
-    
-    Question utilisateur : {user_query}
-    
-    Documents trouvés :
-    {context}
-    
-    INSTRUCTIONS DE FORMATAGE :
-    - Réponds en français, en 1 à 3 paragraphes maximum.
-    - Utilise uniquement du HTML simple (<p>, <strong>, <em>).
-    - Mets en gras les termes médicaux importants.
-    - Ne commence pas par "Voici les documents" ou "D'après les documents".
-    - Sois synthétique, informatif et accessible.
+        context_parts.append(f"\n- Titre : {title}\n  Laboratoire : {laboratoire}\n  Substances : {', '.join(substances)}\n  Extrait : {extrait}")
+    context = ''.join(context_parts)
+    # Seules la question et les documents varient, les instructions sont en message système
+    prompt = f"""Question utilisateur : {user_query}
+
+Documents trouvés :
+{context}"""
+    return {
+        "model": "mistral-small-2503",
+        "messages": [
+            {"role": "system", "content": _SUMMARIZE_SYSTEM},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.6,
+        "max_tokens": 350
+    }
+
+def _docs_cache_key(docs):
+    """Clé exacte du cache de synthèse : identifiants triés des documents utilisés."""
+    ids = [str(doc.get('mongo_id') or doc.get('_id') or doc.get('qdrant_id') or doc.get('title', '')) for doc in docs]
+    return '|'.join(sorted(ids))
+
+# Exact-match RAG answers, checked before the semantic cache (no query encoding needed)
+RAG_ANSWER_EXACT_MAX_ENTRIES = 1024
+_rag_answer_exact = OrderedDict()
+_rag_answer_exact_lock = threading.Lock()
+
+def _exact_answer_key(user_query, docs_key):
+    """Clé du cache exact : question normalisée (casse, espaces) et documents utilisés."""
+    return ' '.join(user_query.lower().split()), docs_key
+
+def _remember_answer(key, answer):
+    """Ajoute une réponse au cache exact en évinçant la plus anciennement utilisée."""
+    with _rag_answer_exact_lock:
+        _rag_answer_exact[key] = answer
+        _rag_answer_exact.move_to_end(key)
+        if len(_rag_answer_exact) > RAG_ANSWER_EXACT_MAX_ENTRIES:
+            _rag_answer_exact.popitem(last=False)
+
+def call_mistral_summarize(user_query, docs, db=None):
     """
+    Utilise Mistral pour générer une réponse synthétique à partir de documents trouvés (RAG).
+    Args:
+        user_query (str): Question utilisateur
+        docs (list): Liste de documents (dict) pertinents trouvés
+        db (pymongo.database.Database, optional): Base MongoDB où persister le cache sémantique
+    Returns:
+        str: Réponse synthétique générée par l'IA
+    """
+    if not MISTRAL_API_KEY:
+        return "<p>Erreur : Clé API Mistral manquante.</p>"
+    # Même question et même jeu de documents : réponse immédiate
+    docs_key = _docs_cache_key(docs)
+    exact_key = _exact_answer_key(user_query, docs_key)
+    with _rag_answer_exact_lock:
+        cached = _rag_answer_exact.get(exact_key)
+        if cached is not None:
+            _rag_answer_exact.move_to_end(exact_key)
+            return cached
+    # Même jeu de documents et question proche : réutiliser la réponse
+    cached, query_embedding = _semantic_lookup(rag_answer_cache, db, user_query, docs_key)
+    if cached is not None:
+        _remember_answer(exact_key, cached)
+        return cached
     try:
-        client = Mistral(api_key=MISTRAL_API_KEY)
-        chat_response = client.chat.complete(
-            model="mistral-small-2503",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.6,
-            max_tokens=350
-        )
-        answer = chat_response.choices[0].message.content.strip()
-        answer = clean_summary_format(answer)
-        if not answer.strip().startswith('<p>'):
-            answer = "<p>" + answer.replace("\n\n", "</p><p>") + "</p>"
-            answer = answer.replace("<p></p>", "")
+        chat_response = _get_mistral_client().chat.complete(**_summarize_request(user_query, docs))
+        answer = format_html_answer(chat_response.choices[0].message.content.strip())
+        _semantic_store(rag_answer_cache, query_embedding, answer, docs_key)
+        _remember_answer(exact_key, answer)
         return answer
     except Exception as e:
         logger.error(f"Erreur lors de la génération de réponse Mistral : {e}")
         return "<p>Impossible de générer une réponse IA pour le moment.</p>"
 
-def generate_medicine_summary(medicine):
+def _iter_sections_text(medicine):
     """
-    Generate an AI summary of the medicine using Mistral AI
+    Yield the titles and texts of a medicine's sections and subsections, in order
     
     Args:
         medicine (dict): Medicine data
         
-    Returns:
-        str: AI-generated summary of the medicine
+    Yields:
+        str: Successive chunks of the section text
     """
-    # Check if API key is available
-    if not MISTRAL_API_KEY:
-        return "<p>Erreur: Clé API non trouvée. Impossible de générer un résumé.</p>"
-    
-    # Extract basic information for the summary
-    title = medicine.get('title', 'Médicament inconnu')
-    substances = medicine.get('medicine_details', {}).get('substances_actives', [])
-    forme = medicine.get('medicine_details', {}).get('forme', 'Non spécifié')
-    laboratoire = medicine.get('medicine_details', {}).get('laboratoire', 'Non spécifié')
-    dosages = medicine.get('medicine_details', {}).get('dosages', [])
-    
-    # Extract ALL content from sections
-    all_sections_text = ""
-    
     if 'sections' in medicine:
         for section in medicine['sections']:
-            section_title = section.get('title', '')
-            all_sections_text += f"\n### {section_title}\n"
+            yield f"\n### {section.get('title', '')}\n"
             
             # Get content from this section
             if 'content' in section and section['content']:
                 for content_item in section['content']:
                     if 'text' in content_item:
-                        all_sections_text += content_item['text'] + "\n"
+                        yield content_item['text']
+                        yield "\n"
             
             # Get content from subsections
             if 'subsections' in section:
                 for subsection in section['subsections']:
-                    subsection_title = subsection.get('title', '')
-                    all_sections_text += f"\n#### {subsection_title}\n"
+                    yield f"\n#### {subsection.get('title', '')}\n"
                     
                     if 'content' in subsection and subsection['content']:
                         for content_item in subsection['content']:
                             if 'text' in content_item:
-                                all_sections_text += content_item['text'] + "\n"
+                                yield content_item['text']
+                                yield "\n"
+
+def _summary_request(medicine):
+    """
+    Build the Mistral chat request parameters for a medicine summary
+    
+    Args:
+        medicine (dict): Medicine data
+        
+    Returns:
+        dict: Keyword arguments for chat.complete / chat.complete_async
+    """
+    # Extract basic information for the summary
+    title = medicine.get('title', 'Médicament inconnu')
+    substances = medicine.get('medicine_details', {}).get('substances_actives', [])
+    forme = medicine.get('medicine_details', {}).get('forme', 'Non spécifié')
+    laboratoire = medicine.get('medicine_details', {}).get('laboratoire', 'Non spécifié')
+    dosages = medicine.get('medicine_details', {}).get('dosages', [])
+    
+    # Collect section content, stopping as soon as the length limit is exceeded
+    parts = []
+    length = 0
+    for chunk in _iter_sections_text(medicine):
+        parts.append(chunk)
+        length += len(chunk)
+        if length > SUMMARY_MAX_CHARS:
+            break
+    all_sections_text = ''.join(parts)
     
     # Limit the total content length to avoid exceeding API limits
-    if len(all_sections_text) > 5000:
-        all_sections_text = all_sections_text[:5000] + "...[contenu tronqué]"
-    
-    # Create a prompt for the API
-    prompt = f"""
-    Génère un résumé concis en français pour le médicament suivant:
-    
-    Nom: {title}
-    Substances actives: {', '.join(substances) if substances else 'Non spécifié'}
-    Forme pharmaceutique: {forme}
-    Laboratoire: {laboratoire}
-    Dosages: {', '.join(str(d) for d in dosages) if dosages else 'Non spécifié'}
-    
-    Informations détaillées sur le médicament:
-    {all_sections_text}
-    
-    Le résumé doit inclure:
-    1. Les utilisations principales de ce médicament
-    2. Comment il fonctionne en termes simples
-    3. Mention brève des effets secondaires courants le cas échéant
-    4. Précautions d'emploi importantes
-    
-    INSTRUCTIONS DE FORMATAGE IMPORTANTES:
-    - Utilise UNIQUEMENT du HTML simple (pas de Markdown)
-    - Format: paragraphes avec balises <p> </p>
-    - Pour le texte en gras, utilise <strong> </strong>
-    - Pour l'italique, utilise <em> </em>
-    - Mets en gras (<strong>) les noms de maladies, symptômes et termes médicaux importants
-    - Mets également en gras les précautions d'emploi cruciales
-    - Maximum 3-4 paragraphes
-    - Ton: Informatif et accessible, adapté à un large public
-    - N'UTILISE PAS de balises de code comme ```html au début ou à la fin
+    if len(all_sections_text) > SUMMARY_MAX_CHARS:
+        all_sections_text = all_sections_text[:SUMMARY_MAX_CHARS] + "...[contenu tronqué]"
+    
+    # Only the medicine data varies; the instructions are sent as the system message
+    prompt = f"""Génère un résumé concis en français pour le médicament suivant:
+
+Nom: {title}
+Substances actives: {', '.join(substances) if substances else 'Non spécifié'}
+Forme pharmaceutique: {forme}
+Laboratoire: {laboratoire}
+Dosages: {', '.join(str(d) for d in dosages) if dosages else 'Non spécifié'}
+
+Informations détaillées sur le médicament:
+{all_sections_text}"""
+    
+    return {
+        "model": "mistral-small-2503",
+        "messages": [
+            {
+                "role": "system",
+                "content": _SUMMARY_SYSTEM
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.7,
+        "max_tokens": 500,
+        # A run of blank lines means the model has finished the HTML paragraphs
+        "stop": ["\n\n\n"]
+    }
+
+def generate_medicine_summary(medicine):
     """
+    Generate an AI summary of the medicine using Mistral AI
     
-    try:
-        # Initialize Mistral client
-        client = Mistral(api_key=MISTRAL_API_KEY)
-        
-        # Make the API request using the Mistral client - using the exact format as our successful test
-        chat_response = client.chat.complete(
-            model="mistral-small-2503",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
+    Args:
+        medicine (dict): Medicine data
         
-        # Extract the generated summary
-        summary = chat_response.choices[0].message.content
+    Returns:
+        str: AI-generated summary of the medicine
+    """
+    # Check if API key is available
+    if not MISTRAL_API_KEY:
+        return "<p>Erreur: Clé API non trouvée. Impossible de générer un résumé.</p>"
+    
+    try:
+        # Make the API request using the shared Mistral client
+        chat_response = _get_mistral_client().chat.complete(**_summary_request(medicine))
         
-        # Clean up the formatting
-        summary = clean_summary_format(summary)
+        # Clean up the formatting and ensure proper HTML
+        return format_html_answer(chat_response.choices[0].message.content)
         
-        # Ensure the summary has proper HTML formatting
-        if not summary.strip().startswith('<p>'):
-            summary = "<p>" + summary.replace("\n\n", "</p><p>") + "</p>"
-            summary = summary.replace("<p></p>", "")
+    except Exception as e:
+        logger.error(f"Erreur lors de la génération du résumé IA: {e}")
+        return f"<p>Impossible de générer un résumé pour le moment. Veuillez réessayer plus tard. Erreur: {str(e)}</p>"
+
+async def _generate_medicine_summary_async(medicine, client, semaphore):
+    """
+    Asynchronous counterpart of generate_medicine_summary
+    
+    Args:
+        medicine (dict): Medicine data
+        client (Mistral): Mistral client shared by the whole batch
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests
         
-        return summary
+    Returns:
+        str: AI-generated summary of the medicine
+    """
+    if not MISTRAL_API_KEY:
+        return "<p>Erreur: Clé API non trouvée. Impossible de générer un résumé.</p>"
+    
+    try:
+        async with semaphore:
+            chat_response = await client.chat.complete_async(**_summary_request(medicine))
+        return format_html_answer(chat_response.choices[0].message.content)
         
     except Exception as e:
         logger.error(f"Erreur lors de la génération du résumé IA: {e}")
         return f"<p>Impossible de générer un résumé pour le moment. Veuillez réessayer plus tard. Erreur: {str(e)}</p>"
 
+async def generate_many_summaries(medicines):
+    """
+    Generate the AI summaries of several medicines concurrently
+    
+    All requests share one HTTP/2 client and overlap on the current event loop,
+    so the total time is close to the slowest request instead of the sum.
+    
+    Args:
+        medicines (list): Medicine data dicts
+        
+    Returns:
+        list: Summaries, in the same order as medicines
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # HTTP/2: the concurrent requests are multiplexed over one TLS connection.
+    # The pool still allows one connection per request in case the server only speaks HTTP/1.1.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS)
+    )
+    async with httpx.AsyncClient(transport=transport, timeout=30.0) as http_client:
+        client = _get_mistral()(api_key=MISTRAL_API_KEY, async_client=http_client)
+        return await asyncio.gather(
+            *[_generate_medicine_summary_async(m, client, semaphore) for m in medicines]
+        )
+
+def generate_summaries(medicines):
+    """
+    Synchronous wrapper around generate_many_summaries
+    
+    Args:
+        medicines (list): Medicine data dicts
+        
+    Returns:
+        list: Summaries, in the same order as medicines
+    """
+    if not medicines:
+        return []
+    return asyncio.run(generate_many_summaries(medicines))
+
+
+def summary_content_hash(medicine):
+    """
+    Hash of everything the summary depends on (the prompt messages built from the medicine)
+    
+    Args:
+        medicine (dict): Medicine data
+        
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    for message in _summary_request(medicine)["messages"]:
+        digest.update(message["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+def _is_error_summary(summary):
+    """True for the placeholder messages returned when no summary could be generated"""
+    return summary.startswith(("<p>Erreur", "<p>Impossible"))
+
+def _is_summary_valid(cached, current_time, content_hash):
+    """A cached summary is reusable while fresh, or as long as the medicine content is unchanged"""
+    if not cached.get('ai_summary'):
+        return False
+    if cached.get('summary_content_hash') == content_hash:
+        return True
+    timestamp = cached.get('summary_timestamp')
+    # Timestamps in the future (clock moved back) are not trusted
+    return bool(timestamp) and (0 <= current_time - timestamp < CACHE_DURATION)
+
+# Summary writes are persisted by a background thread, off the request path
+SUMMARY_WRITE_BATCH_DELAY = 0.1
+_summary_write_queue = queue.Queue()
+
+def _summary_writer_loop():
+    """Persist queued summary updates, grouped into one bulk_write per collection"""
+    while True:
+        pending = [_summary_write_queue.get()]
+        # Gather the writes arriving within the batch delay
+        deadline = time.monotonic() + SUMMARY_WRITE_BATCH_DELAY
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(_summary_write_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        by_collection = {}
+        for collection, operation in pending:
+            by_collection.setdefault(collection, []).append(operation)
+        for collection, operations in by_collection.items():
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Error saving summaries to database: {e}")
+
+threading.Thread(target=_summary_writer_loop, name="summary-writer", daemon=True).start()
+
+def _queue_summary_write(collection, medicine_id, summary, current_time, content_hash):
+    """Queue the update storing a generated summary with its timestamp"""
+    update = {
+        "ai_summary": summary,
+        "summary_timestamp": current_time
+    }
+    # Only real summaries are tied to the content; error messages expire with the TTL
+    if not _is_error_summary(summary):
+        update["summary_content_hash"] = content_hash
+    _summary_write_queue.put((collection, UpdateOne({"_id": medicine_id}, {"$set": update})))
 
 def get_or_generate_summary(medicine, db=None):
     """
     Get cached summary from database or generate a new one
     
+    A cached summary is reused while it is less than CACHE_DURATION old, or
+    whenever it was generated from the same medicine content (strict cache
+    keyed by medicine id and content hash).
+    
     Args:
         medicine (dict): Medicine data
         db (pymongo.database.Database, optional): MongoDB database connection
@@ -339,27 +781,26 @@ def get_or_generate_summary(medicine, db=None):
         str: AI-generated or cached summary
     """
     medicine_id = medicine.get('_id')
+    # Wall-clock seconds, read once: stored in MongoDB and compared across processes
+    # (in-process deadlines such as the Mistral back-off use time.monotonic())
     current_time = int(time.time())
+    content_hash = summary_content_hash(medicine)
     
-    # Check if we already have a summary in the medicine object
-    if medicine.get('ai_summary'):
-        # If we have summary_timestamp and it's less than 10 minutes old, use it
-        if medicine.get('summary_timestamp') and (current_time - medicine.get('summary_timestamp') < CACHE_DURATION):
-            return medicine['ai_summary']
+    # Check if we already have a valid summary in the medicine object
+    if _is_summary_valid(medicine, current_time, content_hash):
+        return medicine['ai_summary']
     
-    # If db is provided, check if summary exists in database and is recent enough
+    # If db is provided, check if a valid summary exists in database
     if db is not None:
         try:
             # Find the medicine and check if it has an ai_summary field
             stored_medicine = db.medicines.find_one(
                 {"_id": medicine_id}, 
-                {"ai_summary": 1, "summary_timestamp": 1}
+                {"ai_summary": 1, "summary_timestamp": 1, "summary_content_hash": 1}
             )
             
-            if stored_medicine and 'ai_summary' in stored_medicine:
-                # Check if summary is less than 10 minutes old
-                if 'summary_timestamp' in stored_medicine and (current_time - stored_medicine['summary_timestamp'] < CACHE_DURATION):
-                    return stored_medicine['ai_summary']
+            if stored_medicine and _is_summary_valid(stored_medicine, current_time, content_hash):
+                return stored_medicine['ai_summary']
                     
         except Exception as e:
             logger.error(f"Error checking for cached summary: {e}")
@@ -367,17 +808,66 @@ def get_or_generate_summary(medicine, db=None):
     # Generate new summary
     summary = generate_medicine_summary(medicine)
     
-    # Save to database if possible with timestamp
+    # Save to database in the background (the caller does not wait for the write)
     if db is not None:
+        _queue_summary_write(db.medicines, medicine_id, summary, current_time, content_hash)
+    
+    return summary
+
+def get_or_generate_summaries(medicines, db=None):
+    """
+    Batch version of get_or_generate_summary
+    
+    Cached summaries of all medicines are fetched with a single $in query,
+    only the misses are sent to Mistral (concurrently), and the new
+    summaries are saved by the background writer.
+    
+    Args:
+        medicines (list): Medicine data dicts
+        db (pymongo.database.Database, optional): MongoDB database connection
+        
+    Returns:
+        list: AI-generated or cached summaries, in the same order as medicines
+    """
+    # Wall-clock seconds, read once for the whole batch (persisted timestamps)
+    current_time = int(time.time())
+    hashes = [summary_content_hash(medicine) for medicine in medicines]
+    summaries = [None] * len(medicines)
+    
+    # Summaries already present on the medicine objects
+    for i, medicine in enumerate(medicines):
+        if _is_summary_valid(medicine, current_time, hashes[i]):
+            summaries[i] = medicine['ai_summary']
+    
+    # One round-trip for all the remaining cached summaries
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if db is not None and missing:
         try:
-            db.medicines.update_one(
-                {"_id": medicine_id},
-                {"$set": {
-                    "ai_summary": summary,
-                    "summary_timestamp": current_time
-                }}
-            )
+            ids = [medicines[i].get('_id') for i in missing]
+            stored = {
+                doc['_id']: doc for doc in db.medicines.find(
+                    {"_id": {"$in": ids}},
+                    {"ai_summary": 1, "summary_timestamp": 1, "summary_content_hash": 1}
+                )
+            }
+            for i in missing:
+                doc = stored.get(medicines[i].get('_id'))
+                if doc and _is_summary_valid(doc, current_time, hashes[i]):
+                    summaries[i] = doc['ai_summary']
         except Exception as e:
-            logger.error(f"Error saving summary to database: {e}")
+            logger.error(f"Error checking for cached summaries: {e}")
     
-    return summary
+    # Generate the genuine misses concurrently
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if not missing:
+        return summaries
+    generated = generate_summaries([medicines[i] for i in missing])
+    for i, summary in zip(missing, generated):
+        summaries[i] = summary
+    
+    # Save all new summaries in the background (grouped into one bulk_write)
+    if db is not None:
+        for i, summary in zip(missing, generated):
+            _queue_summary_write(db.medicines, medicines[i].get('_id'), summary, current_time, hashes[i])
+    
+    return summaries
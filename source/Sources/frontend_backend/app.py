@@ -1,67 +1,235 @@
 from ai_summary import get_or_generate_summary, call_mistral_reformulate, call_mistral_summarize
 # --- Initialisation Flask et Qdrant ---
 
+from flask.json.provider import DefaultJSONProvider
 from flask import Flask, request, render_template, jsonify, abort, redirect, url_for, stream_with_context, Response, session, g
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
-from pymongo import MongoClient
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
 import json
+import orjson
+import re
 from bson import json_util
 import time
 import hashlib
+import base64
+import bisect
+import threading
+import ahocorasick
+from collections import Counter
 from functools import lru_cache
 import os
 import datetime
 import models
-from models import init_db, mongo, User
+from models import init_db, mongo, Comment, Interaction
 import users  # Importer le module users complet
 from users import role_required, users_bp  # Importer la fonction spécifique et blueprint
 from config import get_config
-from vector_search_route import vector_search_bp
+from vector_search_route import vector_search_bp, embed_query, qdrant_client
+
+def bson_default(o):
+    """Sérialisation JSON des types BSON : ObjectId en chaîne, datetime en ISO 8601, le reste via json_util"""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    return json_util.default(o)
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """jsonify accepte directement les documents MongoDB, sans aller-retour json_util.dumps/json.loads"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, (ObjectId, datetime.datetime)):
+            return bson_default(o)
+        return DefaultJSONProvider.default(o)
 
 # --- Initialisation Flask et Qdrant ---
 app = Flask(__name__)
+app.json = BSONJSONProvider(app)
 # Charger la configuration
 
 app_config = get_config()
 app.config.from_object(app_config)
 
-qdrant_client = QdrantClient("qdrant", port=6333)
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-
 # --- Connexion globale à MongoDB ---
-mongo_client = MongoClient('mongodb://host.docker.internal:27017/')
-mongo_db = mongo_client['medicsearch']
+# Important: Initialiser la base de données avant d'accéder à mongo.db
+# Un seul client (celui de Flask-PyMongo, MONGO_URI de la config) pour toute l'application
+init_db(app)
+mongo_db = mongo.db
 medicines_collection = mongo_db['medicaments_traites']
 medic_brut_collection = mongo_db['medic_brut']
 app.logger.info("✅ MongoDB connection initialized")
 
+# Champs couverts par la recherche classique (et poids dans l'index texte)
+SEARCH_TEXT_FIELDS = {
+    "nom": 10,
+    "indications": 5,
+    "composition": 5,
+    "effets_secondaires": 2,
+    "posologie": 1,
+    "contre_indications": 2,
+    "interactions": 1,
+}
+SEARCH_TEXT_INDEX = "medicines_text_search"
+
+# Caractères ayant un sens particulier pour $text (négation, phrase exacte) ou pour une regex
+TEXT_SEARCH_SPECIAL_CHARS = set('-"\\.*+?()[]{}|^$')
+
+# Index texte de la recherche classique en flux (collection title/medicine_details/sections)
+SECTIONS_TEXT_FIELDS = {
+    "title": 10,
+    "sections.content.text": 1,
+    "sections.subsections.content.text": 1,
+}
+SECTIONS_TEXT_INDEX = "sections_text_search"
+
+# Paramètre de filtre -> champ en minuscules (voir scripts/add_lowercase_fields.py)
+SEARCH_FILTER_FIELDS = {
+    'substance': 'medicine_details_lc.substances_actives',
+    'forme': 'medicine_details_lc.forme',
+    'laboratoire': 'medicine_details_lc.laboratoire',
+    'dosage': 'medicine_details_lc.dosages',
+}
+
+# Champs d'origine des options de filtre (distinct), avec la longueur minimale d'une valeur retenue
+FILTER_OPTION_FIELDS = {
+    'substances': ('medicine_details.substances_actives', 2),
+    'formes': ('medicine_details.forme', 2),
+    'laboratoires': ('medicine_details.laboratoire', 2),
+    'dosages': ('medicine_details.dosages', 1),
+}
+
+# Médicaments ayant une composition renseignée ($gt "" : chaîne non vide, compatible avec un index partiel)
+HAS_COMPOSITION_FILTER = {"composition": {"$gt": ""}}
+
+def _create_index(coll, keys, **kwargs):
+    """
+    Crée un index en isolant l'erreur : un index en échec (conflit d'options ou de nom avec
+    un index existant...) n'empêche pas la création des suivants
+    """
+    try:
+        coll.create_index(keys, **kwargs)
+        return True
+    except Exception as e:
+        app.logger.error(f"Erreur création de l'index {kwargs.get('name', keys)} sur {coll.name}: {e}")
+        return False
+
+def _index_names(coll):
+    """Noms des index existants de la collection (vide si la liste est indisponible)"""
+    try:
+        return {index['name'] for index in coll.list_indexes()}
+    except Exception as e:
+        app.logger.error(f"Erreur lecture des index de {coll.name}: {e}")
+        return set()
+
+def ensure_indexes():
+    """Crée les index utilisés par les recherches de l'application s'ils n'existent pas encore"""
+    if SEARCH_TEXT_INDEX not in _index_names(medicines_collection):
+        if _create_index(
+            medicines_collection,
+            [(field, "text") for field in SEARCH_TEXT_FIELDS],
+            weights=SEARCH_TEXT_FIELDS,
+            default_language="french",
+            name=SEARCH_TEXT_INDEX
+        ):
+            app.logger.info("✅ Index texte de recherche créé")
+    
+    # Compteur et vedettes de la page d'accueil
+    _create_index(medicines_collection, "composition", partialFilterExpression=HAS_COMPOSITION_FILTER)
+    _create_index(medicines_collection, "pourcentage_completude")
+    _create_index(medicines_collection, "nom")
+    
+    # Recherche des données brutes par nom exact ou par préfixe ancré (medicine_details)
+    _create_index(medic_brut_collection, "nom")
+    
+    # Tri des résultats par date (clé AAAAMMJJ calculée à l'ingestion) et par nom
+    _create_index(collection, "update_date_key")
+    _create_index(collection, "title")
+    
+    # Recherche classique en flux : index texte sur le titre et le contenu des sections,
+    # et champs de filtre en minuscules pour les regex ancrées
+    if SECTIONS_TEXT_INDEX not in _index_names(collection):
+        if _create_index(
+            collection,
+            [(field, "text") for field in SECTIONS_TEXT_FIELDS],
+            weights=SECTIONS_TEXT_FIELDS,
+            default_language="french",
+            name=SECTIONS_TEXT_INDEX
+        ):
+            app.logger.info("✅ Index texte des sections créé")
+    for field in SEARCH_FILTER_FIELDS.values():
+        _create_index(collection, field)
+    
+    # Options de filtre : distinct lit les valeurs dans l'index (DISTINCT_SCAN) au lieu de la collection
+    for field, _ in FILTER_OPTION_FIELDS.values():
+        _create_index(collection, field)
+
+
+def search_mongodb_regex(query, limit=50, after_id=None):
+    """Recherche littérale par regex (sans index) sur tous les champs de recherche, triée par _id"""
+    # Saisie échappée : sous-chaîne littérale, pas de motif utilisateur (ReDoS) côté MongoDB
+    search_pattern = {"$regex": re.escape(query), "$options": "i"}
+    search_filter = {"$or": [{field: search_pattern} for field in SEARCH_TEXT_FIELDS]}
+    if after_id is not None:
+        search_filter = {"$and": [search_filter, {"_id": {"$gt": after_id}}]}
+    return list(medicines_collection.find(search_filter).sort("_id", 1).limit(limit))
+
 # Fonction helper pour chercher dans MongoDB
-def search_mongodb(query, limit=50):
-    """Cherche les médicaments dans MongoDB"""
+def search_mongodb(query, limit=50, after=None):
+    """
+    Cherche les médicaments dans MongoDB (index texte, regex en dernier recours).
+    `after` = (score, _id) du dernier résultat déjà renvoyé, pour la pagination par curseur ;
+    un score None indique une recherche regex.
+    """
     try:
-        # Utiliser la connexion globale
-        search_pattern = {"$regex": query, "$options": "i"}
-        results = list(medicines_collection.find({
-            "$or": [
-                {"nom": search_pattern},
-                {"indications": search_pattern},
-                {"composition": search_pattern},
-                {"effets_secondaires": search_pattern},
-                {"posologie": search_pattern},
-                {"contre_indications": search_pattern},
-                {"interactions": search_pattern},
-            ]
-        }).limit(limit))
+        if after is not None and after[0] is None:
+            return search_mongodb_regex(query, limit, after_id=after[1])
+        
+        # Les requêtes avec caractères spéciaux ($text : négation, phrase exacte) sont cherchées littéralement
+        if TEXT_SEARCH_SPECIAL_CHARS.intersection(query):
+            return search_mongodb_regex(query, limit)
+        
+        pipeline = [
+            {"$match": {"$text": {"$search": query}}},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        if after is not None:
+            # Reprendre strictement après le dernier résultat (score décroissant, puis _id croissant)
+            score, last_id = after
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "_id": {"$gt": last_id}}
+            ]}})
+        pipeline += [{"$sort": {"score": -1, "_id": 1}}, {"$limit": limit}]
+        try:
+            results = list(medicines_collection.aggregate(pipeline))
+        except OperationFailure as e:
+            # Index texte absent ou inutilisable : même recherche littérale que sans $text
+            app.logger.warning(f"Recherche texte indisponible, regex utilisée: {e}")
+            return search_mongodb_regex(query, limit, after_id=after[1] if after is not None else None)
+        
+        # L'index texte ne trouve que des mots entiers : regex pour les saisies partielles
+        if not results and after is None:
+            results = search_mongodb_regex(query, limit)
         
         return results
     except Exception as e:
         app.logger.error(f"Erreur recherche MongoDB: {e}")
         return []
 
-# Important: Initialiser la base de données avant d'accéder à mongo.db
-init_db(app)
+def encode_search_cursor(doc):
+    """Curseur opaque (base64) pointant après `doc`, renvoyé au client : le serveur reste sans état"""
+    payload = json.dumps({"s": doc.get("score"), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_search_cursor(cursor):
+    """Inverse de encode_search_cursor : renvoie (score, _id), ValueError si le curseur est invalide"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        last_id = payload["id"]
+        return payload["s"], _safe_oid(last_id)
+    except Exception as e:
+        raise ValueError(f"Curseur invalide: {cursor}") from e
 
 # Enregistrer le blueprint users
 app.register_blueprint(users.users_bp)
@@ -72,7 +240,7 @@ register_vector_search_blueprint(app, medicines_collection)
 
 # Utiliser mongo.db pour accéder à la base de données MongoDB après l'initialisation
 # Note: Chercher d'abord 'medic_mistral' (données Mistral), puis 'medicines', puis 'medic_brut' (données brutes)
-db = mongo.db
+db = mongo_db
 if 'medic_mistral' in db.list_collection_names():
     collection = db['medic_mistral']  # ✅ Données Mistral traitées (préféré)
 elif 'medicines' in db.list_collection_names():
@@ -82,6 +250,57 @@ else:
 # Définir db comme attribut de l'application pour qu'il soit accessible partout
 app.db = db
 
+ensure_indexes()
+
+# Documents sans les champs calculés à l'ingestion par scripts/scraper.py
+MISSING_SEARCH_FIELDS_FILTER = {'$or': [
+    {'medicine_details_lc': {'$exists': False}},
+    {'update_date_key': {'$exists': False}},
+]}
+BACKFILL_BATCH_SIZE = 1000
+
+def _backfill_search_fields():
+    """
+    Complète les champs *_lc et update_date_key des documents qui n'en ont pas (base restaurée
+    d'un dump, collection écrite par un autre outil) : sans eux, les filtres et le tri par date
+    de la recherche classique ignorent ces documents. Mêmes calculs que scripts/add_lowercase_fields.py
+    et scripts/add_update_date_key.py.
+    """
+    try:
+        if collection.find_one(MISSING_SEARCH_FIELDS_FILTER, {'_id': 1}) is None:
+            return
+        from scripts.scraper import add_lowercase_fields, french_date_key
+        
+        app.logger.info(f"🔄 Ajout des champs de recherche manquants dans '{collection.name}'...")
+        updated = 0
+        batch = []
+        projection = {'title': 1, 'sections': 1, 'medicine_details': 1, 'update_date': 1}
+        for doc in collection.find(MISSING_SEARCH_FIELDS_FILTER, projection):
+            add_lowercase_fields(doc)
+            fields = {
+                'title_lc': doc['title_lc'],
+                'medicine_details_lc': doc['medicine_details_lc'],
+                'update_date_key': french_date_key(doc.get('update_date')),
+            }
+            if 'sections' in doc:
+                fields['sections'] = doc['sections']
+            batch.append(UpdateOne({'_id': doc['_id']}, {'$set': fields}))
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                updated += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+        app.logger.info(f"✅ {updated} documents complétés dans '{collection.name}'")
+    except Exception as e:
+        app.logger.error(f"Erreur ajout des champs de recherche: {e}")
+
+# En arrière-plan : le démarrage n'attend pas le parcours de la collection
+threading.Thread(target=_backfill_search_fields, name="search-fields-backfill", daemon=True).start()
+
+def _safe_oid(value):
+    """Convertit un identifiant en ObjectId s'il est valide, sinon le renvoie tel quel (ID string)"""
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
 # Fonction pour convertir les objets BSON en JSON serializable
 def bson_to_json(data):
     """Convertit les objets BSON en dictionnaires JSON serialisables"""
@@ -110,12 +329,71 @@ def get_logo():
     """Route pour servir le logo du header"""
     return redirect(url_for('static', filename='img/logo.png'))
 
+def format_home_medicine(med):
+    """Extrait les champs affichés sur la page d'accueil pour un médicament"""
+    pourcentage = med.get('pourcentage_completude', 0)
+    if isinstance(pourcentage, str):
+        try:
+            pourcentage = float(pourcentage)
+        except:
+            pourcentage = 0
+    return {
+        '_id': str(med.get('_id', '')),
+        'nom': med.get('nom', ''),
+        'url': med.get('url', ''),
+        'indications': med.get('indications', '')[:100] if med.get('indications') else '',
+        'pourcentage_completude': pourcentage,
+    }
+
+# Seuls champs affichés sur la page d'accueil (indications tronquées côté serveur)
+HOME_MEDICINE_PROJECTION = {
+    "nom": 1,
+    "url": 1,
+    "indications": {"$substrCP": [{"$ifNull": ["$indications", ""]}, 0, 100]},
+    "pourcentage_completude": 1,
+}
+
+# Cache des données de la page d'accueil (la collection change rarement)
+HOMEPAGE_CACHE_DURATION = 300
+_HOMEPAGE_CACHE = {"ts": 0, "data": None}
+
+def get_homepage_data():
+    """
+    Renvoie (total_medicines, substance_count, new_medicines, featured_medicines),
+    depuis le cache s'il a moins de HOMEPAGE_CACHE_DURATION secondes.
+    """
+    now = time.monotonic()
+    if _HOMEPAGE_CACHE["data"] is not None and now - _HOMEPAGE_CACHE["ts"] < HOMEPAGE_CACHE_DURATION:
+        return _HOMEPAGE_CACHE["data"]
+    
+    # Requêtes séparées plutôt qu'un $facet : les sous-pipelines d'un $facet ne peuvent utiliser aucun index
+    total_medicines = medicines_collection.estimated_document_count()
+    substance_count = medicines_collection.count_documents(HAS_COMPOSITION_FILTER)
+    app.logger.info(f"✅ MongoDB: {total_medicines} médicaments")
+    
+    # Les 10 premiers médicaments (curseur formaté au fil de l'eau, sans liste intermédiaire)
+    recent = medicines_collection.find({}, HOME_MEDICINE_PROJECTION).limit(10)
+    new_medicines = [format_home_medicine(med) for med in recent]
+    app.logger.info(f"✅ Recent medicines found: {len(new_medicines)}")
+    
+    # Médicaments en vedette (complétude >= 70%), pourcentage_completude est stocké en double à l'ingestion
+    featured = medicines_collection.find({"pourcentage_completude": {"$gte": 70}}, HOME_MEDICINE_PROJECTION).limit(6)
+    
+    data = (
+        total_medicines,
+        substance_count,
+        new_medicines,
+        [format_home_medicine(med) for med in featured],
+    )
+    _HOMEPAGE_CACHE["ts"] = now
+    _HOMEPAGE_CACHE["data"] = data
+    return data
+
 @app.route('/')
 def index():
     """Page d'accueil - Affiche les statistiques et les nouveaux médicaments depuis MongoDB"""
     
     total_medicines = 0
-    lab_count = 0
     substance_count = 0
     new_medicines = []
     featured_medicines = []
@@ -124,54 +402,7 @@ def index():
     app.logger.info("INDEX ROUTE CALLED")
     
     try:
-        # Compter les médicaments dans MongoDB (utiliser la connexion globale)
-        total_medicines = medicines_collection.count_documents({})
-        lab_count = total_medicines  # Nombre de labos/médicaments
-        substance_count = medicines_collection.count_documents({"composition": {"$exists": True, "$ne": ""}})
-        app.logger.info(f"✅ MongoDB: {total_medicines} médicaments")
-        
-        # Récupérer les 10 premiers médicaments
-        recent_medicines = list(medicines_collection.find().limit(10))
-        app.logger.info(f"✅ Recent medicines found: {len(recent_medicines)}")
-        
-        for med in recent_medicines:
-            pourcentage = med.get('pourcentage_completude', 0)
-            if isinstance(pourcentage, str):
-                try:
-                    pourcentage = float(pourcentage)
-                except:
-                    pourcentage = 0
-            new_medicines.append({
-                '_id': str(med.get('_id', '')),
-                'nom': med.get('nom', ''),
-                'url': med.get('url', ''),
-                'indications': med.get('indications', '')[:100] if med.get('indications') else '',
-                'pourcentage_completude': pourcentage,
-            })
-        
-        # Récupérer des médicaments en vedette (complétude > 70%)
-        pipeline = [
-            {"$addFields": {"completude_num": {"$toDouble": "$pourcentage_completude"}}},
-            {"$match": {"completude_num": {"$gte": 70}}},
-            {"$limit": 6}
-        ]
-        featured = list(medicines_collection.aggregate(pipeline))
-        
-        for med in featured:
-            pourcentage = med.get('pourcentage_completude', 0)
-            if isinstance(pourcentage, str):
-                try:
-                    pourcentage = float(pourcentage)
-                except:
-                    pourcentage = 0
-            featured_medicines.append({
-                '_id': str(med.get('_id', '')),
-                'nom': med.get('nom', ''),
-                'url': med.get('url', ''),
-                'indications': med.get('indications', '')[:100] if med.get('indications') else '',
-                'pourcentage_completude': pourcentage,
-            })
-        
+        total_medicines, substance_count, new_medicines, featured_medicines = get_homepage_data()
     except Exception as e:
         app.logger.error(f"❌ Erreur index: {e}", exc_info=True)
     
@@ -190,107 +421,66 @@ def index():
         new_medicines=new_medicines
     )
 
+# Durée de validité des options de filtre (une heure)
+FILTER_OPTIONS_TTL = 3600
+
+@lru_cache(maxsize=1)
+def _distinct_filter_options(time_bucket):
+    """
+    Valeurs distinctes des filtres calculées par MongoDB (distinct) sur toute la collection.
+    `time_bucket` ne sert qu'à invalider le cache lru toutes les FILTER_OPTIONS_TTL secondes.
+    """
+    def distinct(field, min_len):
+        # Ignorer les valeurs trop courtes
+        values = (v for v in collection.distinct(field) if v and len(str(v)) > min_len)
+        return sorted(values, key=str)
+    
+    return {
+        option: distinct(field, min_len)
+        for option, (field, min_len) in FILTER_OPTION_FIELDS.items()
+    }
+
 def extract_filter_options():
     """Extrait les options de filtre disponibles à partir de l'ensemble de la base de données"""
-    # Vérifier si nous avons déjà extrait les options de filtrage
-    cached_filters = getattr(extract_filter_options, 'cached_filters', None)
-    if cached_filters:
-        return cached_filters
-    
-    # Initialiser les ensembles pour stocker les valeurs uniques
-    substances_actives = set()
-    formes_pharma = set()
-    laboratoires = set()
-    dosages = set()
-    
-    # Analyser un échantillon représentatif de la base de données
     try:
-        sample_size = 100
-        medicines = list(collection.find().limit(sample_size))
-        
-        for medicine in medicines:
-            # Extraction directement depuis medicine_details
-            if 'medicine_details' in medicine:
-                # Substances actives
-                if 'substances_actives' in medicine['medicine_details'] and medicine['medicine_details']['substances_actives']:
-                    for substance in medicine['medicine_details']['substances_actives']:
-                        if substance and len(substance) > 2:  # Ignorer les valeurs trop courtes
-                            substances_actives.add(substance)
-                
-                # Formes pharmaceutiques
-                if 'forme' in medicine['medicine_details'] and medicine['medicine_details']['forme']:
-                    forme = medicine['medicine_details']['forme']
-                    if forme and len(forme) > 2:  # Ignorer les valeurs trop courtes
-                        formes_pharma.add(forme)
-                
-                # Laboratoires
-                if 'laboratoire' in medicine['medicine_details'] and medicine['medicine_details']['laboratoire']:
-                    laboratoire = medicine['medicine_details']['laboratoire']
-                    if laboratoire and len(laboratoire) > 2:
-                        laboratoires.add(laboratoire)
-                
-                # Dosages
-                if 'dosages' in medicine['medicine_details'] and medicine['medicine_details']['dosages']:
-                    for dosage in medicine['medicine_details']['dosages']:
-                        if dosage and len(str(dosage)) > 1:
-                            dosages.add(dosage)
+        return _distinct_filter_options(int(time.time() // FILTER_OPTIONS_TTL))
     except Exception as e:
+        # Les erreurs ne sont pas mises en cache : on réessaiera au prochain appel
         print(f"Erreur lors de l'extraction des filtres: {e}")
-    
-    # Convertir en listes triées
-    result = {
-        'substances': sorted(list(substances_actives)),
-        'formes': sorted(list(formes_pharma)),
-        'laboratoires': sorted(list(laboratoires)),
-        'dosages': sorted(list(dosages))
-    }
-    
-    # Cacher les résultats comme attribut de la fonction pour les prochains appels
-    extract_filter_options.cached_filters = result
-    return result
+        return {'substances': [], 'formes': [], 'laboratoires': [], 'dosages': []}
+
+def _refresh_filter_options_loop():
+    """Recalcule les options de filtre au démarrage puis à chaque nouvelle tranche de FILTER_OPTIONS_TTL"""
+    while True:
+        extract_filter_options()
+        # Se réveiller juste après le changement de tranche, avant que les requêtes n'en aient besoin
+        time.sleep(FILTER_OPTIONS_TTL - time.time() % FILTER_OPTIONS_TTL + 1)
+
+# Les requêtes /search et /debug trouvent ainsi toujours les filtres déjà en mémoire
+threading.Thread(target=_refresh_filter_options_loop, name="filter-options-refresh", daemon=True).start()
 
 def extract_filter_options_from_results(medicines):
     """Extrait les options de filtre disponibles uniquement à partir des résultats actuels"""
-    # Initialiser les ensembles pour stocker les valeurs uniques
-    substances_actives = set()
-    formes_pharma = set()
-    laboratoires = set()
-    dosages = set()
+    import pandas as pd  # Chargé au premier appel seulement
     
-    # Parcourir les résultats de recherche actuels
-    for medicine in medicines:
-        # Extraction depuis medicine_details
-        if 'medicine_details' in medicine:
-            # Substances actives
-            if 'substances_actives' in medicine['medicine_details'] and medicine['medicine_details']['substances_actives']:
-                for substance in medicine['medicine_details']['substances_actives']:
-                    if substance and len(substance) > 2:  # Ignorer les valeurs trop courtes
-                        substances_actives.add(substance)
-            
-            # Formes pharmaceutiques
-            if 'forme' in medicine['medicine_details'] and medicine['medicine_details']['forme']:
-                forme = medicine['medicine_details']['forme']
-                if forme and len(forme) > 2:  # Ignorer les valeurs trop courtes
-                    formes_pharma.add(forme)
-            
-            # Laboratoires
-            if 'laboratoire' in medicine['medicine_details'] and medicine['medicine_details']['laboratoire']:
-                laboratoire = medicine['medicine_details']['laboratoire']
-                if laboratoire and len(laboratoire) > 2:
-                    laboratoires.add(laboratoire)
-            
-            # Dosages
-            if 'dosages' in medicine['medicine_details'] and medicine['medicine_details']['dosages']:
-                for dosage in medicine['medicine_details']['dosages']:
-                    if dosage and len(str(dosage)) > 1:
-                        dosages.add(dosage)
+    # Un DataFrame des medicine_details : les colonnes sont traitées en bloc plutôt que document par document
+    columns = ['substances_actives', 'forme', 'laboratoire', 'dosages']
+    df = pd.DataFrame([medicine.get('medicine_details') or {} for medicine in medicines]).reindex(columns=columns)
+    
+    def unique_values(column, min_len, explode=False):
+        values = df[column].dropna()
+        if explode:
+            values = values.explode().dropna()
+        # Ignorer les valeurs trop courtes
+        values = values[values.astype(str).str.len() > min_len]
+        # Convertir en liste triée
+        return sorted(values.unique().tolist(), key=str)
     
-    # Convertir en listes triées
     result = {
-        'substances': sorted(list(substances_actives)),
-        'formes': sorted(list(formes_pharma)),
-        'laboratoires': sorted(list(laboratoires)),
-        'dosages': sorted(list(dosages))
+        'substances': unique_values('substances_actives', 2, explode=True),
+        'formes': unique_values('forme', 2),
+        'laboratoires': unique_values('laboratoire', 2),
+        'dosages': unique_values('dosages', 1, explode=True)
     }
     
     return result
@@ -314,293 +504,162 @@ def search():
                           total=len(results),
                           available_filters=available_filters)
 
-@lru_cache(maxsize=1024)
-def convert_french_date_cached(date_str):
-    """Version mise en cache de la conversion de date française"""
-    if not date_str or not isinstance(date_str, str):
-        return 0
-    
-    try:
-        if '/' in date_str:
-            day, month, year = map(int, date_str.split('/'))
-            # Retourner une clé de tri au format AAAAMMJJ
-            return year * 10000 + month * 100 + day
-    except (ValueError, AttributeError):
-        return 0
-    return 0
-
-def sort_medicines_by_date(medicines, sort_direction):
-    """Trie les médicaments par date au format français (JJ/MM/AAAA)"""
-    sort_start_time = time.time()
-    
-    def convert_french_date(medicine):
-        # Vérifier si update_date existe dans le document
-        if 'update_date' not in medicine:
-            return 0
-        
-        # Utiliser la version mise en cache de la conversion
-        return convert_french_date_cached(medicine['update_date'])
-    
-    # Utiliser la fonction de conversion pour trier
-    sorted_medicines = sorted(
-        medicines, 
-        key=convert_french_date,
-        reverse=(sort_direction == -1)  # True si sort_direction est -1 (descendant)
-    )
-    
-    sort_duration = time.time() - sort_start_time
-    print(f"TRI PAR DATE: {len(medicines)} documents triés en {sort_duration:.3f} secondes")
-    
-    return sorted_medicines
+@lru_cache(maxsize=256)
+def build_term_automaton(search_query):
+    """
+    Construit (une fois par requête) un automate Aho-Corasick sur les termes de recherche.
+    La valeur associée à chaque terme est (terme, longueur, multiplicité dans la requête).
+    """
+    multiplicity = Counter(search_query.lower().split())
+    if not multiplicity:
+        return None
+    automaton = ahocorasick.Automaton()
+    for term, mult in multiplicity.items():
+        automaton.add_word(term, (term, len(term), mult))
+    automaton.make_automaton()
+    return automaton
 
-def calculate_relevance_score(medicine, search_query):
-    """Calcule un score de pertinence pour le classement des résultats."""
+def count_terms(automaton, text_lower):
+    """
+    Compte tous les termes en un seul parcours du texte.
+    Les occurrences qui se chevauchent pour un même terme sont ignorées, comme avec str.count.
+    """
+    counts = Counter()
+    if automaton is None or not text_lower:
+        return counts
+    last_end = {}
+    for end, (term, length, mult) in automaton.iter(text_lower):
+        if end - length < last_end.get(term, -1):
+            continue
+        last_end[term] = end
+        counts[term] += mult
+    return counts
+
+def score_and_locate(medicine, search_query):
+    """
+    Calcule le score de pertinence et identifie les endroits où les termes ont été trouvés,
+    en un seul parcours du médicament (chaque texte n'est mis en minuscules qu'une fois).
+    Retourne (score, total_matches, matches) ; les matches sont uniques par (location, terme).
+    """
+    automaton = build_term_automaton(search_query)
     score = 0
-    search_terms = search_query.lower().split()
     total_matches = 0  # Compteur pour le nombre total de correspondances
+    matches_dict = {}
     
-    # Si le terme de recherche est dans le titre (très important)
-    if 'title' in medicine:
-        title = medicine['title'].lower()
-        for term in search_terms:
-            term_count = title.count(term)
-            if term_count > 0:
-                score += 10 * term_count
+    def visit(text, weight, location, priority, exact_bonus=0, excerpt=False, text_lower=None):
+        nonlocal score, total_matches
+        if not text:
+            return
+        # Les champs *_lc précalculés à l'ingestion évitent un str.lower() par requête
+        if text_lower is None:
+            text_lower = text.lower()
+        for term, term_count in count_terms(automaton, text_lower).items():
+            # Un poids nul signifie que le champ n'est affiché que dans les correspondances
+            if weight:
+                score += weight * term_count
                 total_matches += term_count
-                # Si c'est un match exact du titre, c'est encore mieux
-                if title == term:
-                    score += 15
+                if exact_bonus and text_lower == term:
+                    score += exact_bonus
+            
+            key = (location, term)
+            if key in matches_dict:
+                matches_dict[key]['count'] += term_count
+                # On ne remplace pas l'extrait, on garde le premier
+            else:
+                matches_dict[key] = {
+                    'location': location,
+                    'text': extract_excerpt(text, term, text_lower) if excerpt else text,
+                    'term': term,
+                    'count': term_count,
+                    'priority': priority
+                }
     
-    # Si le terme est dans les substances actives (important)
-    if 'medicine_details' in medicine and 'substances_actives' in medicine['medicine_details']:
-        for substance in medicine['medicine_details']['substances_actives']:
-            substance_lower = substance.lower() if substance else ""
-            for term in search_terms:
-                term_count = substance_lower.count(term)
-                if term_count > 0:
-                    score += 8 * term_count
-                    total_matches += term_count
-                    # Match exact de la substance active
-                    if substance_lower == term:
-                        score += 10
+    # Si le terme de recherche est dans le titre (très important)
+    # Si c'est un match exact du titre, c'est encore mieux
+    if 'title' in medicine:
+        visit(medicine['title'], 10, 'Titre', 1, exact_bonus=15, text_lower=medicine.get('title_lc'))
     
-    # Si le terme est dans la forme pharmaceutique ou le dosage (moyennement important)
     if 'medicine_details' in medicine:
-        if 'forme' in medicine['medicine_details']:
-            forme_lower = medicine['medicine_details']['forme'].lower()
-            for term in search_terms:
-                term_count = forme_lower.count(term)
-                if term_count > 0:
-                    score += 5 * term_count
-                    total_matches += term_count
+        details = medicine['medicine_details']
+        
+        # Si le terme est dans les substances actives (important), bonus pour un match exact
+        if details.get('substances_actives'):
+            for substance in details['substances_actives']:
+                visit(substance, 8, 'Substance active', 2, exact_bonus=10)
         
-        if 'dosages' in medicine['medicine_details'] and medicine['medicine_details']['dosages']:
-            for dosage in medicine['medicine_details']['dosages']:
-                dosage_lower = str(dosage).lower() if dosage else ""
-                for term in search_terms:
-                    term_count = dosage_lower.count(term)
-                    if term_count > 0:
-                        score += 5 * term_count
-                        total_matches += term_count
+        # Le laboratoire n'entre pas dans le score
+        if details.get('laboratoire'):
+            visit(details['laboratoire'], 0, 'Laboratoire', 3)
+        
+        # Si le terme est dans la forme pharmaceutique ou le dosage (moyennement important)
+        if details.get('forme'):
+            visit(details['forme'], 5, 'Forme pharmaceutique', 3)
+        
+        if details.get('dosages'):
+            for dosage in details['dosages']:
+                visit(str(dosage) if dosage else "", 5, 'Dosage', 3)
     
     # Si le terme est dans le contenu (moins important)
     if 'sections' in medicine:
+        # Les sections avec des informations importantes ont un poids plus élevé
+        important_sections = ["1. DENOMINATION DU MEDICAMENT", "2. COMPOSITION QUALITATIVE ET QUANTITATIVE"]
         for section in medicine['sections']:
-            section_importance = 0
-            # Les sections avec des informations importantes ont un poids plus élevé
-            important_sections = ["1. DENOMINATION DU MEDICAMENT", "2. COMPOSITION QUALITATIVE ET QUANTITATIVE"]
-            if section['title'] in important_sections:
-                section_importance = 3
+            section_title = section.get('title', '')
+            section_importance = 3 if section_title in important_sections else 0
             
             # Vérifier le titre de la section
-            section_title_lower = section['title'].lower()
-            for term in search_terms:
-                term_count = section_title_lower.count(term)
-                if term_count > 0:
-                    score += (2 + section_importance) * term_count
-                    total_matches += term_count
+            visit(section_title, 2 + section_importance, f"Section: {section_title}", 3, text_lower=section.get('title_lc'))
             
             if 'content' in section and section['content']:
                 for content_item in section['content']:
                     if 'text' in content_item:
-                        text_lower = content_item['text'].lower()
-                        for term in search_terms:
-                            term_count = text_lower.count(term)
-                            if term_count > 0:
-                                score += (1 + section_importance) * term_count
-                                total_matches += term_count
+                        visit(content_item['text'], 1 + section_importance, section_title, 4, excerpt=True,
+                              text_lower=content_item.get('text_lc'))
             
             # Chercher dans les sous-sections
-            if 'subsections' in section:
+            if 'subsections' in section and section['subsections']:
                 for subsection in section['subsections']:
+                    subsection_title = subsection.get('title', '')
+                    location = f"{section_title} > {subsection_title}"
+                    
                     # Vérifier le titre de la sous-section
-                    subsection_title_lower = subsection['title'].lower()
-                    for term in search_terms:
-                        term_count = subsection_title_lower.count(term)
-                        if term_count > 0:
-                            score += 2 * term_count
-                            total_matches += term_count
+                    visit(subsection_title, 2, location, 3, text_lower=subsection.get('title_lc'))
                     
                     if 'content' in subsection and subsection['content']:
                         for content_item in subsection['content']:
                             if 'text' in content_item:
-                                text_lower = content_item['text'].lower()
-                                for term in search_terms:
-                                    term_count = text_lower.count(term)
-                                    if term_count > 0:
-                                        score += 1 * term_count
-                                        total_matches += term_count
+                                visit(content_item['text'], 1, location, 4, excerpt=True,
+                                      text_lower=content_item.get('text_lc'))
     
     # Ajouter le nombre total de correspondances au score pour qu'il compte dans le tri
     score += total_matches
     
-    # Stocker le nombre de correspondances dans l'objet médicament pour l'affichage
-    medicine['match_count'] = total_matches
-    
-    return score
-
-def find_search_term_locations(medicine, search_query):
-    """Identifie les endroits où les termes de recherche ont été trouvés dans un médicament, sans doublons visuels."""
-    if not search_query:
-        return []
+    return score, total_matches, list(matches_dict.values())
 
-    matches_dict = {}
-    search_terms = search_query.lower().split()
-
-    def add_match(location, text, term, count, priority):
-        key = (location, term)
-        if key in matches_dict:
-            matches_dict[key]['count'] += count
-            # On ne remplace pas l'extrait, on garde le premier
-        else:
-            matches_dict[key] = {
-                'location': location,
-                'text': text,  # Premier extrait rencontré
-                'term': term,
-                'count': count,
-                'priority': priority
-            }
 
-    # Vérifier dans le titre
-    if 'title' in medicine:
-        title_lower = medicine['title'].lower()
-        for term in search_terms:
-            if term in title_lower:
-                term_count = title_lower.count(term)
-                add_match('Titre', medicine['title'], term, term_count, 1)
-
-    # Vérifier dans les détails du médicament
-    if 'medicine_details' in medicine:
-        # Chercher dans substances_actives
-        if 'substances_actives' in medicine['medicine_details'] and medicine['medicine_details']['substances_actives']:
-            for substance in medicine['medicine_details']['substances_actives']:
-                substance_lower = substance.lower() if substance else ""
-                for term in search_terms:
-                    if term in substance_lower:
-                        term_count = substance_lower.count(term)
-                        add_match('Substance active', substance, term, term_count, 2)
-
-        # Chercher dans laboratoire
-        if 'laboratoire' in medicine['medicine_details'] and medicine['medicine_details']['laboratoire']:
-            lab_lower = medicine['medicine_details']['laboratoire'].lower()
-            for term in search_terms:
-                if term in lab_lower:
-                    term_count = lab_lower.count(term)
-                    add_match('Laboratoire', medicine['medicine_details']['laboratoire'], term, term_count, 3)
-
-        # Chercher dans forme
-        if 'forme' in medicine['medicine_details'] and medicine['medicine_details']['forme']:
-            forme_lower = medicine['medicine_details']['forme'].lower()
-            for term in search_terms:
-                if term in forme_lower:
-                    term_count = forme_lower.count(term)
-                    add_match('Forme pharmaceutique', medicine['medicine_details']['forme'], term, term_count, 3)
-
-        # Chercher dans dosages
-        if 'dosages' in medicine['medicine_details'] and medicine['medicine_details']['dosages']:
-            for dosage in medicine['medicine_details']['dosages']:
-                dosage_str = str(dosage).lower() if dosage else ""
-                for term in search_terms:
-                    if term in dosage_str:
-                        term_count = dosage_str.count(term)
-                        add_match('Dosage', str(dosage), term, term_count, 3)
-
-    # Chercher dans le contenu des sections
-    if 'sections' in medicine:
-        for section in medicine['sections']:
-            section_title = section.get('title', '')
+# Fins de phrase utilisées pour délimiter les extraits
+_SENT_END = re.compile(r'[.!?]')
 
-            # Vérifier d'abord dans le titre de la section
-            section_title_lower = section_title.lower()
-            for term in search_terms:
-                if term in section_title_lower:
-                    term_count = section_title_lower.count(term)
-                    add_match(f"Section: {section_title}", section_title, term, term_count, 3)
-
-            # Chercher dans le contenu de la section
-            if 'content' in section and section['content']:
-                for content_item in section['content']:
-                    if 'text' in content_item and content_item['text']:
-                        text_lower = content_item['text'].lower()
-                        for term in search_terms:
-                            if term in text_lower:
-                                term_count = text_lower.count(term)
-                                excerpt = extract_excerpt(content_item['text'], term)
-                                add_match(section_title, excerpt, term, term_count, 4)
-
-            # Chercher dans le contenu des sous-sections
-            if 'subsections' in section and section['subsections']:
-                for subsection in section['subsections']:
-                    subsection_title = subsection.get('title', '')
-
-                    # Vérifier dans le titre de la sous-section
-                    subsection_title_lower = subsection_title.lower()
-                    for term in search_terms:
-                        if term in subsection_title_lower:
-                            term_count = subsection_title_lower.count(term)
-                            add_match(f"{section_title} > {subsection_title}", subsection_title, term, term_count, 3)
-
-                    if 'content' in subsection and subsection['content']:
-                        for content_item in subsection['content']:
-                            if 'text' in content_item and content_item['text']:
-                                text_lower = content_item['text'].lower()
-                                for term in search_terms:
-                                    if term in text_lower:
-                                        term_count = text_lower.count(term)
-                                        excerpt = extract_excerpt(content_item['text'], term)
-                                        add_match(f"{section_title} > {subsection_title}", excerpt, term, term_count, 4)
-
-    # Retourner la liste des matches uniques (par location et terme)
-    return list(matches_dict.values())
-
-
-def extract_excerpt(text, term):
+def extract_excerpt(text, term, text_lower=None):
     """Extrait un court extrait du texte autour du terme recherché."""
     term_lower = term.lower()
-    text_lower = text.lower()
+    if text_lower is None:
+        text_lower = text.lower()
     
     # Trouver la position du terme dans le texte
     pos = text_lower.find(term_lower)
     if pos == -1:
         return text[:100] + "..."  # Retourner le début du texte si terme non trouvé
     
-    # Trouver le début and la fin de la phrase contenant le terme
-    sentence_start = max(0, text_lower.rfind('.', 0, pos))
-    if sentence_start == 0:
-        # Si pas de point trouvé, essayer d'autres délimiteurs
-        sentence_start = max(0, text_lower.rfind('!', 0, pos))
-        sentence_start = max(0, text_lower.rfind('?', 0, pos))
+    # Un seul parcours du texte pour toutes les fins de phrase (position juste après le délimiteur)
+    ends = [m.end() for m in _SENT_END.finditer(text_lower)]
     
-    sentence_end = text_lower.find('.', pos)
-    if sentence_end == -1:
-        # Si pas de point trouvé, chercher d'autres délimiteurs ou prendre la fin du texte
-        sentence_end = text_lower.find('!', pos)
-        if sentence_end == -1:
-            sentence_end = text_lower.find('?', pos)
-            if sentence_end == -1:
-                sentence_end = len(text)
-    else:
-        sentence_end += 1  # Inclure le point final
+    # La phrase commence après le dernier délimiteur avant le terme...
+    i = bisect.bisect_right(ends, pos)
+    sentence_start = ends[i - 1] if i > 0 else 0
+    # ... et se termine au premier délimiteur après le terme (inclus)
+    j = bisect.bisect_left(ends, pos + len(term_lower))
+    sentence_end = ends[j] if j < len(ends) else len(text)
     
     # Si la phrase est trop longue, créer un extrait plus court autour du terme
     if sentence_end - sentence_start > 150:
@@ -615,7 +674,7 @@ def extract_excerpt(text, term):
     excerpt = ""
     if start_pos > 0:
         excerpt += "..."
-    excerpt += text[start_pos:end_pos]
+    excerpt += text[start_pos:end_pos].strip()
     if end_pos < len(text):
         excerpt += "..."
     
@@ -626,37 +685,51 @@ def medicine_details(id):
     """Route pour les détails d'un médicament spécifique"""
     try:
         # Convertir la string ID en ObjectId pour MongoDB
-        try:
-            medicine_id = ObjectId(id)
-        except:
-            # Si ce n'est pas un ObjectId valide, chercher comme string
-            medicine_id = id
+        # Si ce n'est pas un ObjectId valide, chercher comme string
+        medicine_id = _safe_oid(id)
         
-        # Chercher le médicament dans medicaments_traites
-        medicine = medicines_collection.find_one({'_id': medicine_id})
+        # Chercher le médicament dans medicaments_traites, avec ses données brutes de medic_brut
+        # (même ID ou même nom) jointes par $lookup : un seul aller-retour vers MongoDB
+        medicine = next(medicines_collection.aggregate([
+            {'$match': {'_id': medicine_id}},
+            {'$limit': 1},
+            {'$addFields': {'_nom_trim': {'$trim': {'input': {'$ifNull': ['$nom', '']}}}}},
+            # Deux jointures égalité localField/foreignField : chacune utilise un index (_id, nom)
+            {'$lookup': {
+                'from': medic_brut_collection.name,
+                'localField': '_id',
+                'foreignField': '_id',
+                'as': '_brut_by_id'
+            }},
+            {'$lookup': {
+                'from': medic_brut_collection.name,
+                'localField': '_nom_trim',
+                'foreignField': 'nom',
+                'pipeline': [{'$limit': 1}],
+                'as': '_brut_by_nom'
+            }},
+            {'$project': {'_nom_trim': 0}}
+        ]), None)
         if not medicine:
             abort(404)
         
         # Essayer de récupérer les données brutes de medic_brut avec le même ID ou par nom
         try:
-            medic_brut = medic_brut_collection.find_one({'_id': medicine_id})
+            # Préférer la correspondance par ID à celle par nom
+            brut_matches = medicine.pop('_brut_by_id', []) + medicine.pop('_brut_by_nom', [])
+            medic_brut = brut_matches[0] if brut_matches else None
             
-            # Si pas trouvé par ID, chercher par nom (exact et fuzzy)
-            if not medic_brut and 'nom' in medicine:
-                nom = medicine['nom'].strip()
-                medic_brut = medic_brut_collection.find_one({'nom': nom})
-            
-            # Si toujours pas trouvé, essayer une recherche partielle
+            # Si toujours pas trouvé, chercher par préfixe (regex ancrée : parcours de l'index sur nom)
             if not medic_brut and 'nom' in medicine:
                 nom_parts = medicine['nom'].split()
-                medic_brut = medic_brut_collection.find_one({
-                    'nom': {'$regex': nom_parts[0], '$options': 'i'}
-                })
+                if nom_parts:
+                    medic_brut = medic_brut_collection.find_one({
+                        'nom': {'$regex': f"^{re.escape(nom_parts[0])}"}
+                    })
             
             if medic_brut:
-                # Convertir les ObjectId en strings pour pouvoir les sérialiser
-                medic_brut_converted = json.loads(json_util.dumps(medic_brut))
-                medicine['medic_brut_data'] = medic_brut_converted
+                # Les ObjectId sont convertis avec le reste du médicament lors de la sérialisation finale
+                medicine['medic_brut_data'] = medic_brut
                 print(f"✓ Données brutes trouvées pour {medicine.get('nom', 'N/A')}")
             else:
                 print(f"❌ Aucune donnée brute trouvée pour {medicine.get('nom', 'N/A')}")
@@ -679,78 +752,23 @@ def medicine_details(id):
         
         # Si l'utilisateur est connecté, récupérer ses interactions
         if 'user_id' in request.cookies:
-            from models import Interaction, Comment
             user_id = request.cookies.get('user_id')
             is_favorite = Interaction.is_favorite(user_id, str(medicine['_id']))
             user_role = request.cookies.get('role')
             if user_role:
                 user_role = int(user_role)
             
-            # Récupérer les commentaires pour ce médicament visibles par l'utilisateur
-            comments = Comment.get_for_medicine(str(medicine['_id']), user_role)
+            # Récupérer les commentaires pour ce médicament visibles par l'utilisateur, avec leurs auteurs
+            comments = Comment.get_for_medicine_with_authors(str(medicine['_id']), user_role)
         else:
             # Même pour les utilisateurs non connectés, récupérer les commentaires publics
-            from models import Comment
-            comments = Comment.get_for_medicine(str(medicine['_id']))
-        
-        # Ajouter les informations utilisateur à chaque commentaire, que l'utilisateur soit connecté ou non
-        for comment in comments:
-            try:
-                comment_user = User.get_by_id(comment['user_id'])
-                if comment_user:
-                    comment['user'] = {
-                        'first_name': comment_user.get('first_name', 'Utilisateur'),
-                        'last_name': comment_user.get('last_name', '')
-                    }
-            except Exception as e:
-                print(f"Erreur lors de la récupération des données utilisateur: {e}")
-                # Si on ne peut pas récupérer l'utilisateur, on met un placeholder
-                comment['user'] = {
-                    'first_name': 'Utilisateur',
-                    'last_name': ''
-                }
+            comments = Comment.get_for_medicine_with_authors(str(medicine['_id']))
         
-        # S'assurer que chaque élément de contenu a un champ html_content
-        if 'sections' in medicine:
-            for section in medicine['sections']:
-                if 'content' in section:
-                    for content_item in section['content']:
-                        # Traiter le texte normal
-                        if 'text' in content_item and 'html_content' not in content_item:
-                            # Créer un contenu HTML basique si manquant
-                            text = content_item['text']
-                            # Convertir les sauts de ligne en <br>
-                            html_text = text.replace('\n', '<br>')
-                            # Garder le texte simple en HTML mais avec les sauts de ligne
-                            content_item['html_content'] = f"<p>{html_text}</p>"
-                        
-                        # S'assurer que les tableaux sont correctement formatés
-                        if 'table' in content_item and isinstance(content_item['table'], list):
-                            # Le tableau est déjà bien formaté, pas besoin de le modifier
-                            pass
-                
-                # Traiter également les sous-sections
-                if 'subsections' in section:
-                    for subsection in section['subsections']:
-                        if 'content' in subsection:
-                            for content_item in subsection['content']:
-                                # Traiter le texte normal
-                                if 'text' in content_item and 'html_content' not in content_item:
-                                    text = content_item['text']
-                                    html_text = text.replace('\n', '<br>')
-                                    content_item['html_content'] = f"<p>{html_text}</p>"
-                                
-                                # S'assurer que les tableaux sont correctement formatés
-                                if 'table' in content_item and isinstance(content_item['table'], list):
-                                    # Le tableau est déjà bien formaté, pas besoin de le modifier
-                                    pass
-        
-        # Convertir en JSON pour l'affichage brut (convertir les ObjectId)
-        medicine_converted = json.loads(json_util.dumps(medicine))
-        medicine_json = json.dumps(medicine_converted, indent=2, ensure_ascii=False)
+        # Convertir en JSON pour l'affichage brut (convertir les ObjectId), une seule sérialisation
+        medicine_json = json.dumps(medicine, default=bson_default, indent=2, ensure_ascii=False)
         
         return render_template('medicine_detail.html', 
-                               medicine=medicine_converted, 
+                               medicine=medicine, 
                                medicine_json=medicine_json,
                                is_favorite=is_favorite,
                                comments=comments)
@@ -762,25 +780,41 @@ def medicine_details(id):
 @app.route('/raw/<id>')
 def raw_medicine(id):
     """Route pour voir les données brutes d'un médicament en JSON"""
-    try:
-        medicine = collection.find_one({'_id': ObjectId(id)})
-        if not medicine:
-            abort(404)
-        return jsonify(json.loads(json_util.dumps(medicine)))
-    except:
+    # Un ID invalide ne correspond à aucun document : 404 sans exception
+    medicine = collection.find_one({'_id': _safe_oid(id)})
+    if not medicine:
         abort(404)
+    # Sérialisé directement par BSONJSONProvider
+    return jsonify(medicine)
 
-@app.route('/debug')
-def debug_info():
-    """Page de debug pour afficher la structure de la base de données"""
+# Structure de la base pour /debug : le schéma change rarement
+DEBUG_INFO_TTL = 60
+
+@lru_cache(maxsize=1)
+def _debug_collection_info(time_bucket):
+    """
+    Statistiques, document exemple et champs présents dans la collection.
+    `time_bucket` ne sert qu'à invalider le cache lru toutes les DEBUG_INFO_TTL secondes.
+    """
     collection_stats = db.command("collStats", "medicines")
     sample_doc = collection.find_one()
     sample_json = json_util.dumps(sample_doc, indent=2)
     
-    # Liste des champs présents dans les documents
-    fields = set()
-    for doc in collection.find().limit(100):
-        fields.update(doc.keys())
+    # Liste des champs présents dans les documents (sur un échantillon de 100),
+    # calculée par MongoDB : seuls les noms de champs sont renvoyés
+    fields = sorted(field['_id'] for field in collection.aggregate([
+        {'$sample': {'size': 100}},
+        {'$project': {'k': {'$objectToArray': '$$ROOT'}}},
+        {'$unwind': '$k'},
+        {'$group': {'_id': '$k.k'}}
+    ]))
+    
+    return collection_stats, sample_json, fields
+
+@app.route('/debug')
+def debug_info():
+    """Page de debug pour afficher la structure de la base de données"""
+    collection_stats, sample_json, fields = _debug_collection_info(int(time.time() // DEBUG_INFO_TTL))
     
     # Get filter options
     available_filters = extract_filter_options()
@@ -788,24 +822,43 @@ def debug_info():
     return render_template('debug.html', 
                           stats=collection_stats,
                           sample=sample_json,
-                          fields=sorted(list(fields)),
+                          fields=fields,
                           available_filters=available_filters)
 
+# Pagination par `page` (liens existants) : nombre maximal de résultats parcourus avant la page
+# demandée, ceux-ci étant chargés puis ignorés ; au-delà, la pagination par curseur est requise
+SEARCH_PAGE_MAX_OFFSET = 1000
+
 @app.route('/api/search-results')
 def search_results_api():
-    """API de recherche utilisant MongoDB"""
+    """
+    API de recherche utilisant MongoDB.
+    Pagination par curseur : passer `cursor` = `next_cursor` de la page précédente.
+    Le paramètre `page` reste accepté pour les liens existants.
+    """
     try:
         search_query = request.args.get('search', '')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        per_page = min(max(int(request.args.get('per_page', app.config['DEFAULT_PAGE_SIZE'])), 1),
+                       app.config['MAX_PAGE_SIZE'])
+        cursor = request.args.get('cursor')
+        page = max(int(request.args.get('page', 1)), 1)
         
-        # Récupérer les résultats de MongoDB
-        results = search_mongodb(search_query, limit=100)
+        # Un résultat de plus que demandé pour savoir s'il existe une page suivante
+        if cursor:
+            try:
+                after = decode_search_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            results = search_mongodb(search_query, limit=per_page + 1, after=after)
+        else:
+            start = (page - 1) * per_page
+            if start > SEARCH_PAGE_MAX_OFFSET:
+                return jsonify({'error': f"Page trop lointaine (au-delà de {SEARCH_PAGE_MAX_OFFSET} résultats) : "
+                                         "utiliser le paramètre cursor"}), 400
+            results = search_mongodb(search_query, limit=start + per_page + 1)[start:]
         
-        # Pagination
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_results = results[start:end]
+        has_next = len(results) > per_page
+        paginated_results = results[:per_page]
         
         # Formater les résultats
         formatted_results = []
@@ -825,10 +878,10 @@ def search_results_api():
         
         return jsonify({
             'results': formatted_results,
-            'total': len(results),
             'page': page,
             'per_page': per_page,
-            'pages': (len(results) + per_page - 1) // per_page
+            'has_next': has_next,
+            'next_cursor': encode_search_cursor(paginated_results[-1]) if has_next else None
         })
     
     except Exception as e:
@@ -837,59 +890,121 @@ def search_results_api():
 
 
 
+# Champs lus par le flux de résultats (affichage et score_and_locate), y compris les versions *_lc
+SEARCH_STREAM_PROJECTION = {
+    'title': 1, 'title_lc': 1, 'update_date': 1, 'medicine_details': 1,
+    'sections.title': 1, 'sections.title_lc': 1,
+    'sections.content.text': 1, 'sections.content.text_lc': 1,
+    'sections.subsections.title': 1, 'sections.subsections.title_lc': 1,
+    'sections.subsections.content.text': 1, 'sections.subsections.content.text_lc': 1,
+}
+
+# Durée pendant laquelle le nombre total de résultats d'une même requête est réutilisé
+SEARCH_COUNT_TTL = 60
+
+@lru_cache(maxsize=512)
+def _count_search_results(query_json, time_bucket):
+    """Nombre de résultats d'une requête (sérialisée), mis en cache par tranche de SEARCH_COUNT_TTL"""
+    return collection.count_documents(json_util.loads(query_json))
+
+def count_search_results(query):
+    """Nombre total de résultats : métadonnées de la collection sans filtre, comptage en cache sinon"""
+    if not query:
+        return collection.estimated_document_count()
+    return _count_search_results(json_util.dumps(query, sort_keys=True), int(time.time() // SEARCH_COUNT_TTL))
+
+# Options de tri de la recherche classique ; 'relevance' trie par score de l'index texte
+SEARCH_SORT_OPTIONS = {
+    'date_desc': ('update_date_key', -1),
+    'date_asc': ('update_date_key', 1),
+    'name_asc': ('title', 1),
+    'name_desc': ('title', -1),
+}
+
 @app.route('/api/search-results-stream')
 def search_results_api_stream():
     search_query = request.args.get('search', '')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 10))
-    substance = request.args.get('substance', '')
-    forme = request.args.get('forme', '')
-    laboratoire = request.args.get('laboratoire', '')
-    dosage = request.args.get('dosage', '')
     sort_option = request.args.get('sort', 'date_desc')
+    sort_spec = SEARCH_SORT_OPTIONS.get(sort_option)
 
-    query = {}
-    pipeline_filters = []
+    # Filtres par champ : préfixe ancré, sensible à la casse, sur les champs en minuscules (parcours d'index)
+    field_filters = []
+    for param, field in SEARCH_FILTER_FIELDS.items():
+        value = request.args.get(param, '')
+        if value:
+            field_filters.append({field: {'$regex': '^' + re.escape(value.lower())}})
 
-    # Construction de la requête de recherche
-    if search_query:
-        search_regex = {'$regex': search_query, '$options': 'i'}
-        pipeline_filters.append({'$or': [
-            {'title': search_regex},
-            {'medicine_details.substances_actives': search_regex},
-            {'sections.content.text': search_regex},  # Recherche dans les sections
-            {'sections.subsections.content.text': search_regex},
-            {'sections.subsections.subsections.content.text': search_regex}
-        ]})
-    if substance:
-        pipeline_filters.append({'medicine_details.substances_actives': {'$regex': substance, '$options': 'i'}})
-    if forme:
-        pipeline_filters.append({'medicine_details.forme': {'$regex': forme, '$options': 'i'}})
-    if laboratoire:
-        pipeline_filters.append({'medicine_details.laboratoire': {'$regex': laboratoire, '$options': 'i'}})
-    if dosage:
-        pipeline_filters.append({'medicine_details.dosages': {'$regex': dosage, '$options': 'i'}})
-
-    # Combiner les filtres avec $and
-    if pipeline_filters:
-        query['$and'] = pipeline_filters
+    def build_query(use_text):
+        pipeline_filters = list(field_filters)
+        # Construction de la requête de recherche
+        if search_query and use_text:
+            pipeline_filters.insert(0, {'$text': {'$search': search_query}})
+        elif search_query:
+            # Saisie échappée : sous-chaîne littérale, comme le comptage des termes côté Python
+            search_regex = {'$regex': re.escape(search_query), '$options': 'i'}
+            pipeline_filters.insert(0, {'$or': [
+                {'title': search_regex},
+                {'medicine_details.substances_actives': search_regex},
+                {'sections.content.text': search_regex},  # Recherche dans les sections
+                {'sections.subsections.content.text': search_regex},
+                {'sections.subsections.subsections.content.text': search_regex}
+            ]})
+        # Combiner les filtres avec $and
+        return {'$and': pipeline_filters} if pipeline_filters else {}
+
+    def find_page(query, use_text):
+        """Résultats de la page demandée (au plus per_page documents, chargés en une fois)"""
+        medicines = collection.find(query, SEARCH_STREAM_PROJECTION)
+        if sort_spec:
+            # Tri côté MongoDB (indexé) avant la pagination
+            medicines = medicines.sort(*sort_spec)
+        elif use_text:
+            medicines = medicines.sort([('score', {'$meta': 'textScore'})])
+        return list(medicines.skip((page - 1) * per_page).limit(per_page).batch_size(per_page)) # Charger les résultats par page
 
     def generate():
-        total_results = collection.count_documents(query) # Calculer le nombre total de résultats
+        # Index texte par défaut ; les requêtes avec caractères spéciaux sont cherchées littéralement par regex
+        use_text = bool(search_query) and not TEXT_SEARCH_SPECIAL_CHARS.intersection(search_query)
+        query = build_query(use_text)
+        try:
+            total_results = count_search_results(query) # Calculer le nombre total de résultats
+        except OperationFailure as e:
+            # Index texte absent ou inutilisable : recherche regex, comme search_mongodb
+            app.logger.warning(f"Recherche texte indisponible, regex utilisée: {e}")
+            use_text = False
+            query = build_query(use_text)
+            total_results = count_search_results(query)
+        if use_text and total_results == 0:
+            # L'index texte ne trouve que des mots entiers : regex pour les saisies partielles
+            use_text = False
+            query = build_query(use_text)
+            total_results = count_search_results(query)
         
-        # Envoyer le nombre total de résultats
-        total_update = json.dumps({'total': total_results})
-        yield f"event: total\ndata: {total_update}\n\n"
+        # Envoyer le nombre total de résultats (entier : pas besoin de sérialiseur JSON)
+        yield f'event: total\ndata: {{"total": {total_results}}}\n\n'
 
-        medicines = collection.find(query).skip((page - 1) * per_page).limit(per_page) # Charger les résultats par page
+        try:
+            try:
+                medicines = find_page(query, use_text)
+            except OperationFailure as e:
+                if not use_text:
+                    raise
+                app.logger.warning(f"Recherche texte indisponible, regex utilisée: {e}")
+                use_text = False
+                medicines = find_page(build_query(use_text), use_text)
+        except Exception as e:
+            # Le flux se termine normalement (événement de fin) même sans résultats
+            app.logger.error(f"Erreur recherche en flux: {e}")
+            medicines = []
         
         result_count = 0
         for medicine in medicines:
             if search_query:
-                relevance_score = calculate_relevance_score(medicine, search_query)
-                medicine['search_matches'] = find_search_term_locations(medicine, search_query)
+                relevance_score, match_count, medicine['search_matches'] = score_and_locate(medicine, search_query)
             else:
-                relevance_score = 0
+                relevance_score, match_count = 0, 0
                 medicine['search_matches'] = []
             
             formatted_result = {
@@ -898,26 +1013,28 @@ def search_results_api_stream():
                 'update_date': medicine.get('update_date', 'Non disponible'),
                 'medicine_details': medicine.get('medicine_details', {}),
                 'relevance_score': relevance_score,
-                'match_count': medicine.get('match_count', 0),
+                'match_count': match_count,
                 'search_matches': medicine['search_matches']
             }
             
-            # Convertir le résultat en JSON
-            json_result = json.dumps(formatted_result, ensure_ascii=False)
-            
-            # Envoyer le résultat via le flux d'événements
-            yield f"data: {json_result}\n\n"
+            # Convertir le résultat en JSON (orjson : UTF-8 direct, bien plus rapide que json.dumps)
+            json_result = orjson.dumps(formatted_result, default=bson_default).decode()
             
             result_count += 1
             
-            # Envoyer la mise à jour du compteur
-            count_update = json.dumps({'count': result_count})
-            yield f"event: count\ndata: {count_update}\n\n"
+            # Envoyer le résultat et la mise à jour du compteur en une seule écriture
+            # (deux événements SSE distincts, protocole inchangé pour le client)
+            yield f'data: {json_result}\n\nevent: count\ndata: {{"count": {result_count}}}\n\n'
 
         # Envoyer un événement de fin de flux
         yield "data: end\n\n"
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        # Transmettre chaque événement immédiatement (pas de mise en tampon par un proxy nginx)
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # Ajout de la page d'erreur 404
 @app.errorhandler(404)
@@ -947,13 +1064,10 @@ def toggle_favorite(medicine_id):
     user_id = request.cookies.get('user_id')
     
     try:
-        # Vérifier si le médicament existe
-        medicine = collection.find_one({'_id': ObjectId(medicine_id)})
-        if not medicine:
+        # Vérifier si le médicament existe (comptage sur l'index _id, sans charger le document)
+        if not collection.count_documents({'_id': _safe_oid(medicine_id)}, limit=1):
             return jsonify({"success": False, "message": "Médicament non trouvé"}), 404
         
-        from models import Interaction
-        
         # Vérifier si le médicament est déjà un favori
         if Interaction.is_favorite(user_id, medicine_id):
             # Supprimer des favoris
@@ -971,18 +1085,28 @@ def toggle_favorite(medicine_id):
         print(f"Erreur lors de la gestion des favoris: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+# Champs utilisés par get_or_generate_summary (prompt, hash du contenu et cache du résumé)
+SUMMARY_PROJECTION = {
+    'title': 1,
+    'medicine_details': 1,
+    'sections.title': 1,
+    'sections.content.text': 1,
+    'sections.subsections.title': 1,
+    'sections.subsections.content.text': 1,
+    'ai_summary': 1,
+    'summary_timestamp': 1,
+    'summary_content_hash': 1,
+}
+
 @app.route('/api/medicine-summary/<id>')
 def get_medicine_summary(id):
     """API endpoint to get the AI summary of a medicine"""
     try:
         # Convertir la string en ObjectId
-        try:
-            medicine_id = ObjectId(id)
-        except:
-            medicine_id = id
+        medicine_id = _safe_oid(id)
         
-        # Chercher le médicament dans MongoDB
-        medicine = medicines_collection.find_one({'_id': medicine_id})
+        # Chercher le médicament dans MongoDB, limité aux champs lus par le résumé
+        medicine = medicines_collection.find_one({'_id': medicine_id}, SUMMARY_PROJECTION)
         if not medicine:
             return jsonify({"success": False, "message": "Médicament non trouvé"}), 404
         
@@ -1005,6 +1129,75 @@ def get_medicine_summary(id):
         print(f"Error retrieving medicine summary: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+# Champs du payload Qdrant utilisés par la recherche IA (affichage des résultats, ID MongoDB)
+AI_SEARCH_PAYLOAD_FIELDS = ['nom', 'mongo_id', 'composition', 'indications', 'effets_secondaires', 'posologie']
+
+# Durée de réutilisation des résultats d'une recherche IA (l'index Qdrant peut être reconstruit)
+AI_SEARCH_CACHE_TTL = 300
+
+def find_ai_search_docs(reformulated_query):
+    """
+    Recherche vectorielle Qdrant pour la recherche IA, avec l'ID MongoDB de chaque résultat.
+    Le résultat (tuple) est mis en cache par tranche de AI_SEARCH_CACHE_TTL : les appelants
+    doivent copier les documents avant de les modifier.
+    """
+    try:
+        return _find_ai_search_docs(reformulated_query, int(time.time() // AI_SEARCH_CACHE_TTL))
+    except LookupError:
+        # Aucun résultat (index vide ou en cours de reconstruction) : non mis en cache
+        return ()
+
+@lru_cache(maxsize=1024)
+def _find_ai_search_docs(reformulated_query, time_bucket):
+    """Recherche de find_ai_search_docs ; LookupError si aucun résultat (les exceptions ne sont pas mises en cache)"""
+    # Générer l'embedding
+    embedding = embed_query(reformulated_query)
+    
+    # Recherche vectorielle Qdrant
+    search_results = qdrant_client.query_points(
+        collection_name="medicaments",
+        query=embedding,
+        limit=100,  # Augmenté pour avoir plus de candidats à filtrer
+        score_threshold=0.2,  # Score minimum pour les résultats bruts
+        with_payload=AI_SEARCH_PAYLOAD_FIELDS
+    ).points
+    print(f"DEBUG: Nombre de résultats bruts Qdrant: {len(search_results)}")
+    
+    # Garder les résultats avec score >= 0.25
+    hits = [hit for hit in search_results if getattr(hit, 'score', None) and hit.score >= 0.25]
+    
+    # IDs MongoDB manquants dans le payload : une seule requête $in sur le nom (index nom)
+    # au lieu d'un find_one par résultat
+    noms_missing_id = list({
+        hit.payload.get('nom', '') for hit in hits
+        if hasattr(hit, 'payload') and not hit.payload.get('mongo_id')
+    })
+    ids_by_nom = {}
+    if noms_missing_id:
+        for medicine in medicines_collection.find({'nom': {'$in': noms_missing_id}}, {'nom': 1}):
+            # Premier document trouvé pour un nom, comme find_one
+            ids_by_nom.setdefault(medicine['nom'], str(medicine['_id']))
+    
+    # Traiter les résultats Qdrant seulement
+    docs = []
+    
+    for hit in hits:
+        payload = hit.payload if hasattr(hit, 'payload') else {}
+        doc = dict(payload)
+        doc['score'] = hit.score
+        doc['qdrant_id'] = hit.id
+        
+        # Ajouter l'ID MongoDB du payload ou celui trouvé par nom dans MongoDB
+        mongo_id = payload.get('mongo_id', '') or ids_by_nom.get(payload.get('nom', ''))
+        if mongo_id:
+            doc['mongo_id'] = mongo_id
+        
+        docs.append(doc)
+    
+    if not docs:
+        raise LookupError(reformulated_query)
+    return tuple(docs)
+
 @app.route('/ai-search', methods=['GET', 'POST'])
 def ai_search():
     """Recherche IA avec reformulation et synthèse via Mistral"""
@@ -1018,47 +1211,11 @@ def ai_search():
         if user_query:
             try:
                 # 1. Reformuler la question avec Mistral
-                reformulated_query = call_mistral_reformulate(user_query)
+                reformulated_query = call_mistral_reformulate(user_query, db=mongo_db)
                 print(f"DEBUG: Requête reformulée: {reformulated_query}")
                 
-                # 2. Générer l'embedding
-                embedding = embedding_model.encode(reformulated_query).tolist()
-                
-                # 3. Recherche vectorielle Qdrant
-                search_results = qdrant_client.query_points(
-                    collection_name="medicaments",
-                    query=embedding,
-                    limit=100,  # Augmenté pour avoir plus de candidats à filtrer
-                    score_threshold=0.2  # Score minimum pour les résultats bruts
-                ).points
-                print(f"DEBUG: Nombre de résultats bruts Qdrant: {len(search_results)}")
-                
-                # 4. Traiter les résultats Qdrant seulement
-                docs = []
-                
-                for hit in search_results:
-                    payload = hit.payload if hasattr(hit, 'payload') else {}
-                    score = getattr(hit, 'score', None)
-                    
-                    # Garder les résultats avec score >= 0.25
-                    if score and score >= 0.25:
-                        doc = dict(payload)
-                        doc['score'] = score
-                        doc['qdrant_id'] = hit.id
-                        
-                        # Ajouter l'ID MongoDB du payload ou chercher dans MongoDB
-                        mongo_id_str = payload.get('mongo_id', '')
-                        if mongo_id_str:
-                            doc['mongo_id'] = mongo_id_str
-                        else:
-                            # Chercher par nom dans MongoDB
-                            nom = payload.get('nom', '')
-                            medicine = medicines_collection.find_one({'nom': nom})
-                            if medicine:
-                                mongo_id = str(medicine.get('_id', ''))
-                                doc['mongo_id'] = mongo_id
-                        
-                        docs.append(doc)
+                # 2-4. Embedding, recherche vectorielle Qdrant et traitement des résultats (en cache par requête reformulée)
+                docs = [dict(doc) for doc in find_ai_search_docs(reformulated_query)]
                 
                 # Trier par score descendant
                 docs.sort(key=lambda x: x['score'], reverse=True)
@@ -1071,7 +1228,7 @@ def ai_search():
                 
                 # 5. Générer la réponse IA
                 if results:
-                    ai_answer = call_mistral_summarize(user_query, results)
+                    ai_answer = call_mistral_summarize(user_query, results, db=mongo_db)
                 else:
                     ai_answer = "Aucun résultat trouvé pour votre recherche."
                     
@@ -5,15 +5,16 @@ Script simple pour exporter la base MongoDB
 Crée un fichier ZIP avec toutes les données
 """
 
-import json
 import os
 from pathlib import Path
 from datetime import datetime
 from pymongo import MongoClient
 from bson import ObjectId
 from dotenv import load_dotenv
+import orjson
+import base64
 import zipfile
-import shutil
+from itertools import chain
 
 # Charger .env
 script_dir = Path(__file__).parent
@@ -24,14 +25,45 @@ MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/medicsearch')
 DB_NAME = 'medicsearch'
 
 
-class MongoEncoder(json.JSONEncoder):
-    """Convertir ObjectId et datetime en strings"""
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        elif isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+# Compression rapide : l'export est limité par le CPU, pas par la taille du ZIP
+ZIP_COMPRESSLEVEL = 1
+BATCH_SIZE = 1000
+
+
+def mongo_default(obj):
+    """
+    Convertir ObjectId en string et les données binaires (bytes, bson.Binary : embeddings
+    des caches) en base64 (orjson gère déjà les datetime en ISO 8601)
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError
+
+
+def ecrire_collection(zf, collection):
+    """
+    Écrit une collection dans le ZIP sous forme de tableau JSON, document par document
+    (mémoire constante quelle que soit la taille de la collection).
+    Retourne le nombre de documents exportés (0 : collection vide, rien n'est écrit).
+    """
+    cursor = collection.find({}, batch_size=BATCH_SIZE)
+    first_doc = next(cursor, None)
+    if first_doc is None:
+        return 0
+    
+    count = 0
+    # force_zip64 : taille finale inconnue à l'ouverture, peut dépasser 2 Go
+    with zf.open(f"{collection.name}.json", 'w', force_zip64=True) as f:
+        f.write(b"[\n")
+        for doc in chain([first_doc], cursor):
+            if count:
+                f.write(b",\n")
+            f.write(orjson.dumps(doc, default=mongo_default, option=orjson.OPT_INDENT_2))
+            count += 1
+        f.write(b"\n]")
+    return count
 
 
 def exporter_base():
@@ -51,42 +83,29 @@ def exporter_base():
         print(f"❌ Erreur: {e}")
         return False
     
-    # Créer dossier temporaire
+    # Créer le ZIP directement, sans fichiers JSON intermédiaires
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    temp_dir = Path("export_temp")
-    temp_dir.mkdir(exist_ok=True)
+    zip_name = f"medicsearch_backup_{timestamp}.zip"
     
     # Exporter chaque collection
     print("\n📥 Export collections...")
     try:
-        for collection_name in db.list_collection_names():
-            docs = list(db[collection_name].find({}))
-            
-            if docs:
-                filename = temp_dir / f"{collection_name}.json"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(docs, f, cls=MongoEncoder, indent=2, ensure_ascii=False)
-                print(f"  ✅ {collection_name}: {len(docs)} documents")
-            else:
-                print(f"  ⏭️  {collection_name}: vide")
-    
-    except Exception as e:
-        print(f"❌ Erreur export: {e}")
-        return False
-    
-    # Créer ZIP
-    print("\n📦 Compression...")
-    zip_name = f"medicsearch_backup_{timestamp}.zip"
-    
-    try:
-        shutil.make_archive(zip_name[:-4], 'zip', temp_dir)
-        shutil.rmtree(temp_dir)
+        with zipfile.ZipFile(zip_name, 'w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=ZIP_COMPRESSLEVEL) as zf:
+            for collection_name in db.list_collection_names():
+                count = ecrire_collection(zf, db[collection_name])
+                
+                if count:
+                    print(f"  ✅ {collection_name}: {count} documents")
+                else:
+                    print(f"  ⏭️  {collection_name}: vide")
         
         size_mb = Path(zip_name).stat().st_size / 1024 / 1024
-        print(f"✅ Fichier créé: {zip_name} ({size_mb:.1f} MB)")
-        
+        print(f"\n✅ Fichier créé: {zip_name} ({size_mb:.1f} MB)")
+    
     except Exception as e:
-        print(f"❌ Erreur: {e}")
+        print(f"❌ Erreur export: {e}")
+        Path(zip_name).unlink(missing_ok=True)
         return False
     
     # Résumé
@@ -14,12 +14,15 @@ if sys.platform == 'win32':
 
 from pymongo import MongoClient
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import Distance, VectorParams, OptimizersConfigDiff
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import os
 from dotenv import load_dotenv
 import time
 import hashlib
+from itertools import islice, tee
+from operator import itemgetter
 
 # CONFIG
 load_dotenv()
@@ -29,8 +32,43 @@ QDRANT_PORT = int(os.getenv('QDRANT_PORT', 6333))
 
 BATCH_SIZE_UPSERT = 256
 BATCH_SIZE_EMBEDDING = 128
+# Requêtes d'upsert envoyées en parallèle par upload_points
+UPLOAD_PARALLEL = 4
+# Intervalle minimal (secondes) entre deux lignes de progression
+PROGRESS_INTERVAL = 1.0
 COLLECTION = "medicaments"
 MODEL = "all-MiniLM-L6-v2"
+# Index HNSW construit une seule fois après l'import (0 = pas d'indexation pendant les upserts)
+INDEXING_THRESHOLD = 20000
+
+# Champs du texte riche encodé après le nom, dans l'ordre : (étiquette, champ MongoDB)
+TEXTE_RICHE_FIELDS = (
+    ('COMPOSITION', 'composition'),
+    ('INDICATIONS', 'indications'),
+    ('POSOLOGIE', 'posologie'),
+    ('CONTRE_INDICATIONS', 'contre_indications'),
+    ('EFFETS_SECONDAIRES', 'effets_secondaires'),
+    ('INTERACTIONS', 'interactions'),
+    ('INTERACTIONS_GRAVES', 'interactions_graves'),
+    ('MISES_EN_GARDE', 'mises_en_garde'),
+)
+
+# Documents lus et triés par longueur ensemble (en lots d'upsert) : mémoire bornée
+SORT_WINDOW_BATCHES = 8
+
+# Champs lus par creer_texte_riche et les payloads : le reste des documents n'est pas transféré
+# (dérivés de TEXTE_RICHE_FIELDS pour rester synchronisés avec le texte encodé)
+INDEX_PROJECTION = [
+    'nom', *(field for _, field in TEXTE_RICHE_FIELDS),
+    'url', 'pourcentage_completude'
+]
+
+# Cache des embeddings entre deux indexations : SHA-256 (modèle + texte riche) -> vecteur.
+# Seuls les textes modifiés ou nouveaux repassent dans model.encode.
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embeddings_cache.npz')
+)
 
 
 class IndexerAmeliore:
@@ -38,59 +76,85 @@ class IndexerAmeliore:
         self.model = None
         self.mongo = None
         self.qdrant = None
+        self.embedding_cache = self.load_embedding_cache()
+        # Embeddings des textes de cette indexation (seuls conservés dans le cache sauvegardé)
+        self.used_embeddings = {}
+        self.indexed_count = 0
 
     def load_model(self):
         if self.model is None:
             print("⏳ Chargement modèle...", flush=True)
-            self.model = SentenceTransformer(MODEL)
-            print(f"✅ {MODEL} chargé", flush=True)
+            import torch  # Dépendance de sentence_transformers
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.model = SentenceTransformer(MODEL, device=device)
+            if device == 'cuda':
+                # FP16 sur GPU : encodage bien plus rapide, précision suffisante pour la similarité cosinus
+                self.model.half()
+            print(f"✅ {MODEL} chargé ({device})", flush=True)
         return self.model
 
+    def load_embedding_cache(self):
+        if not os.path.exists(EMBEDDING_CACHE_PATH):
+            return {}
+        try:
+            with np.load(EMBEDDING_CACHE_PATH) as data:
+                cache = dict(zip(data['hashes'].tolist(), data['vectors']))
+            print(f"✅ Cache embeddings: {len(cache)} vecteurs", flush=True)
+            return cache
+        except Exception as e:
+            print(f"⚠️  Cache embeddings illisible, ignoré: {e}", flush=True)
+            return {}
+
+    def save_embedding_cache(self):
+        if not self.used_embeddings:
+            return
+        hashes = list(self.used_embeddings)
+        vectors = np.stack([self.used_embeddings[h] for h in hashes]).astype(np.float32)
+        # Écriture dans un fichier temporaire puis remplacement : pas de cache tronqué si interrompu
+        tmp_path = EMBEDDING_CACHE_PATH + '.tmp.npz'
+        np.savez(tmp_path, hashes=np.array(hashes), vectors=vectors)
+        os.replace(tmp_path, EMBEDDING_CACHE_PATH)
+        print(f"💾 Cache embeddings sauvegardé: {len(hashes)} vecteurs", flush=True)
+
+    def text_hash(self, text):
+        return hashlib.sha256(f"{MODEL}\n{text}".encode()).hexdigest()
+
     def create_id(self, text):
-        return int(hashlib.md5(text.encode()).hexdigest(), 16) % (2**63 - 1)
+        # Entier 64 bits lu directement dans le digest (pas d'aller-retour hexadécimal) ;
+        # identique à create_id de vector_search_route.py
+        return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
 
     def create_collection(self):
         print(f"📦 Collection: {COLLECTION}", flush=True)
-        cols = [c.name for c in self.qdrant.get_collections().collections]
-        
-        if COLLECTION in cols:
+        if self.qdrant.collection_exists(COLLECTION):
             print("🔄 Suppression...", flush=True)
             self.qdrant.delete_collection(COLLECTION)
         
         self.qdrant.create_collection(
             collection_name=COLLECTION,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            vectors_config=VectorParams(size=384, distance=Distance.COSINE),
+            # Import en masse : pas de construction incrémentale de l'index HNSW à chaque upsert
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=0)
         )
         print(f"✅ {COLLECTION} créée", flush=True)
 
+    def enable_indexing(self):
+        # Déclenche la construction de l'index HNSW en une fois, sur toute la collection
+        self.qdrant.update_collection(
+            collection_name=COLLECTION,
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+        )
+        print("✅ Indexation HNSW activée", flush=True)
+
     def creer_texte_riche(self, doc):
         """
         Crée un texte riche avec le contexte complet du médicament
         """
-        nom = doc.get('nom', 'Unknown')
-        composition = doc.get('composition', '')
-        indications = doc.get('indications', '')
-        interactions = doc.get('interactions', '')
-        effets_secondaires = doc.get('effets_secondaires', '')
-        contre_indications = doc.get('contre_indications', '')
-        posologie = doc.get('posologie', '')
-        mises_en_garde = doc.get('mises_en_garde', '')
-        interactions_graves = doc.get('interactions_graves', '')
-        
-        # Texte enrichi avec tous les champs disponibles
-        texte_riche = f"""
-        [NOM] {nom}
-        [COMPOSITION] {composition}
-        [INDICATIONS] {indications}
-        [POSOLOGIE] {posologie}
-        [CONTRE_INDICATIONS] {contre_indications}
-        [EFFETS_SECONDAIRES] {effets_secondaires}
-        [INTERACTIONS] {interactions}
-        [INTERACTIONS_GRAVES] {interactions_graves}
-        [MISES_EN_GARDE] {mises_en_garde}
-        """.strip()
-        
-        return texte_riche
+        # Une ligne "[TAG] valeur" par champ renseigné : les champs vides n'ajoutent
+        # que des tokens inutiles à l'encodage
+        lignes = [f"[NOM] {doc.get('nom', 'Unknown')}"]
+        lignes.extend(f"[{tag}] {doc[field]}" for tag, field in TEXTE_RICHE_FIELDS if doc.get(field))
+        return "\n".join(lignes)
 
     def prepare_batch(self, documents):
         model = self.load_model()
@@ -119,43 +183,100 @@ class IndexerAmeliore:
                 'mongo_id': str(doc.get('_id', ''))  # ✅ Stocker l'ObjectId MongoDB
             })
 
-        # Encoder TOUS les textes riches en batch
-        vectors = model.encode(texts, batch_size=BATCH_SIZE_EMBEDDING, show_progress_bar=False)
-
-        points = []
-        for vector, metadata, doc in zip(vectors, metadatas, documents):
-            point = PointStruct(
-                id=self.create_id(metadata['nom']),
-                vector=vector.tolist() if hasattr(vector, 'tolist') else list(vector),
-                payload=metadata
+        # Encoder en batch uniquement les textes riches absents du cache, une seule fois chacun
+        # (les doublons exacts, fréquents entre dosages/conditionnements, partagent leur vecteur)
+        hashes = [self.text_hash(text) for text in texts]
+        misses = {}
+        for text, h in zip(texts, hashes):
+            if h not in self.embedding_cache:
+                misses.setdefault(h, text)
+        if misses:
+            encoded = model.encode(
+                list(misses.values()),
+                batch_size=BATCH_SIZE_EMBEDDING,
+                show_progress_bar=False,
+                convert_to_numpy=True
             )
-            points.append(point)
+            self.embedding_cache.update(zip(misses, encoded))
+        vectors = [self.embedding_cache[h] for h in hashes]
+        self.used_embeddings.update(zip(hashes, vectors))
+
+        # Une seule conversion (N, 384) -> listes Python, faite en C par NumPy
+        vector_lists = np.stack(vectors).tolist()
+        ids = [self.create_id(metadata['nom']) for metadata in metadatas]
 
-        return points
+        # Listes parallèles (ids, vecteurs, payloads) : envoyées en models.Batch,
+        # sans construire ni valider un PointStruct par document
+        return ids, vector_lists, metadatas
 
-    def index(self, documents):
-        total = len(documents)
+    def iter_batches(self, documents):
+        """
+        Lots d'upsert lus au fil du curseur, par fenêtres de SORT_WINDOW_BATCHES lots triées
+        par longueur du texte riche : lots de longueurs homogènes, donc moins de padding dans
+        chaque batch d'encodage (model.encode ne trie que les textes d'un même appel).
+        L'ordre d'upsert est sans effet, les IDs des points ne dépendent que du nom.
+        """
+        documents = iter(documents)
+        while True:
+            window = list(islice(documents, BATCH_SIZE_UPSERT * SORT_WINDOW_BATCHES))
+            if not window:
+                return
+            window.sort(key=lambda doc: len(self.creer_texte_riche(doc)))
+            for batch_idx in range(0, len(window), BATCH_SIZE_UPSERT):
+                yield window[batch_idx:batch_idx + BATCH_SIZE_UPSERT]
+
+    def iter_points(self, documents, total, start):
+        """(id, vecteur, payload) prêts à l'upload, encodés lot par lot au fil du curseur, avec la progression"""
+        self.indexed_count = 0
+        last_print = 0.0
+        for batch in self.iter_batches(documents):
+            yield from zip(*self.prepare_batch(batch))
+
+            self.indexed_count += len(batch)
+            # Au plus une ligne par PROGRESS_INTERVAL secondes (le résumé final donne le total exact)
+            now = time.monotonic()
+            if now - last_print < PROGRESS_INTERVAL:
+                continue
+            last_print = now
+
+            # total est une estimation : plafonner la progression affichée
+            percent = min(self.indexed_count / total, 1) * 100 if total else 100
+            elapsed = int(time.time() - start)
+
+            print(f"✓ [{self.indexed_count}/{total}] ({percent:.1f}%) - {elapsed}s", flush=True)
+
+    def index(self, documents, total):
+        """Indexe les documents (itérable, ex. curseur MongoDB) ; `total` sert à la progression"""
         start = time.time()
 
         print(f"🚀 Indexation {total} documents (VERSION AMÉLIORÉE)", flush=True)
         print()
 
-        for batch_idx in range(0, total, BATCH_SIZE_UPSERT):
-            batch = documents[batch_idx:batch_idx + BATCH_SIZE_UPSERT]
-            points = self.prepare_batch(batch)
-            
-            self.qdrant.upsert(collection_name=COLLECTION, points=points)
-
-            percent = ((batch_idx + len(batch)) / total) * 100
-            elapsed = int(time.time() - start)
+        # Upload en masse du client Qdrant : UPLOAD_PARALLEL processus envoient les lots
+        # pendant que ce processus encode les suivants (le générateur est consommé au fil de l'eau).
+        # upload_collection lit ids, vecteurs et payloads en parallèle et les envoie en models.Batch ;
+        # tee ne garde en mémoire que l'écart entre ces trois lectures (au plus un lot).
+        ids, vectors, payloads = (
+            map(itemgetter(position), records)
+            for position, records in enumerate(tee(self.iter_points(documents, total, start), 3))
+        )
+        self.qdrant.upload_collection(
+            collection_name=COLLECTION,
+            ids=ids,
+            vectors=vectors,
+            payload=payloads,
+            batch_size=BATCH_SIZE_UPSERT,
+            parallel=UPLOAD_PARALLEL
+        )
+        done = self.indexed_count
 
-            print(f"✓ [{batch_idx + len(batch)}/{total}] ({percent:.1f}%) - {elapsed}s", flush=True)
+        self.save_embedding_cache()
 
         elapsed = int(time.time() - start)
-        speed = total / elapsed if elapsed > 0 else 0
+        speed = done / elapsed if elapsed > 0 else 0
 
         print("\n" + "="*80)
-        print(f"✅ {total} documents indexés (AMÉLIORÉ)")
+        print(f"✅ {done} documents indexés (AMÉLIORÉ)")
         print(f"📁 Collection: {COLLECTION}")
         print(f"⏱️  Temps: {elapsed}s")
         print(f"⚡ Vitesse: {speed:.1f} docs/sec")
@@ -180,6 +301,7 @@ def main():
     print("="*80)
 
     indexer = IndexerAmeliore()
+    collection_created = False
 
     try:
         print("\n🔌 Connexion MongoDB...", flush=True)
@@ -193,13 +315,17 @@ def main():
         print("✅ OK", flush=True)
 
         indexer.create_collection()
+        collection_created = True
 
         print("\n📥 Récupération documents...", flush=True)
-        documents = list(col.find())
-        print(f"✅ {len(documents)} trouvés", flush=True)
+        # Métadonnées de la collection : pas de parcours des documents
+        total = col.estimated_document_count()
+        print(f"✅ ~{total} trouvés", flush=True)
 
-        if documents:
-            indexer.index(documents)
+        if total:
+            # Documents lus au fil de l'indexation (curseur), pas chargés tous en mémoire
+            documents = col.find({}, INDEX_PROJECTION, batch_size=BATCH_SIZE_UPSERT)
+            indexer.index(documents, total)
 
         indexer.mongo.close()
 
@@ -208,6 +334,12 @@ def main():
         import traceback
         traceback.print_exc()
 
+    finally:
+        # Même si la collection est vide ou l'import interrompu : sans cela, la collection
+        # resterait sans index HNSW (recherche exhaustive) et les prochains upserts aussi
+        if collection_created:
+            indexer.enable_indexing()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,12 +1,19 @@
 from flask_pymongo import PyMongo
+from pymongo import UpdateOne, WriteConcern
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from bson.objectid import ObjectId
+import time
 from flask import current_app
 
 # Initialize PyMongo with None - will be configured in the application
 mongo = PyMongo()
 
+# Roles are read on every page that checks a role; they change only through Role methods.
+# The TTL bounds staleness for updates made by another process.
+ROLE_CACHE_TTL = 60
+_role_cache = {}  # role_id -> (monotonic expiry, role document or None)
+
 class Role:
     """Model for the roles collection in MongoDB"""
     
@@ -132,18 +139,24 @@ class Role:
             }
         ]
         
-        for role in default_roles:
-            # Use upsert to insert if not exists or update if exists
-            mongo.db.roles.update_one(
-                {"_id": role["_id"]}, 
-                {"$set": role}, 
-                upsert=True
-            )
+        # Use upsert to insert if not exists or update if exists (one round-trip for all roles)
+        mongo.db.roles.bulk_write([
+            UpdateOne({"_id": role["_id"]}, {"$set": role}, upsert=True)
+            for role in default_roles
+        ], ordered=False)
+        _role_cache.clear()
     
     @staticmethod
     def get_by_id(role_id):
-        """Get a role by its ID"""
-        return mongo.db.roles.find_one({"_id": int(role_id)})
+        """Get a role by its ID (cached for ROLE_CACHE_TTL seconds; do not modify the returned dict)"""
+        role_id = int(role_id)
+        cached = _role_cache.get(role_id)
+        now = time.monotonic()
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        role = mongo.db.roles.find_one({"_id": role_id})
+        _role_cache[role_id] = (now + ROLE_CACHE_TTL, role)
+        return role
     
     @staticmethod
     def get_all_roles():
@@ -161,10 +174,12 @@ class Role:
     @staticmethod
     def update_permissions(role_id, permissions):
         """Update permissions for a role"""
-        return mongo.db.roles.update_one(
+        modified = mongo.db.roles.update_one(
             {"_id": int(role_id)},
             {"$set": {"permissions": permissions}}
         ).modified_count > 0
+        _role_cache.pop(int(role_id), None)
+        return modified
 
 # Update User class to use Role model
 class User:
@@ -283,8 +298,9 @@ class User:
             return None
             
         if check_password_hash(user["password_hash"], password):
-            # Update the last login date
-            mongo.db.users.update_one(
+            # Update the last login date (unacknowledged write: the login does not wait for it,
+            # and only verified logins are stamped)
+            mongo.db.users.with_options(write_concern=WriteConcern(w=0)).update_one(
                 {"_id": user["_id"]}, 
                 {"$set": {"last_login": datetime.utcnow()}}
             )
@@ -379,6 +395,39 @@ class Comment:
             
         return list(mongo.db.comments.find(query).sort("timestamp", -1))
     
+    @staticmethod
+    def get_for_medicine_with_authors(medicine_id, user_role=None):
+        """Retrieve comments for a medicine with their author's name, joined server-side in one aggregation"""
+        query = {
+            "medicine_id": medicine_id,
+            "status": Comment.STATUS_PUBLISHED
+        }
+        
+        # Filter comments by visibility according to the user's role
+        if user_role is not None:
+            query["visibility"] = user_role
+        
+        def author_field(field, default):
+            # Placeholder when the author no longer exists or has no such field
+            return {"$ifNull": [{"$arrayElemAt": [f"$_author.{field}", 0]}, default]}
+        
+        return list(mongo.db.comments.aggregate([
+            {"$match": query},
+            {"$sort": {"timestamp": -1}},
+            # Join on the users _id index
+            {"$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "_id",
+                "as": "_author"
+            }},
+            {"$addFields": {"user": {
+                "first_name": author_field("first_name", "Utilisateur"),
+                "last_name": author_field("last_name", "")
+            }}},
+            {"$project": {"_author": 0}}
+        ]))
+    
     @staticmethod
     def update(comment_id, user_id, update_data):
         """Update a comment (only by the author)"""
@@ -468,15 +517,6 @@ class Interaction:
         
         return [i["medicine_id"] for i in interactions]
     
-    @staticmethod
-    def is_favorite(user_id, medicine_id):
-        """Check if a medicine is in the favorites"""
-        return mongo.db.interactions.find_one({
-            "user_id": ObjectId(user_id),
-            "medicine_id": medicine_id,
-            "type": Interaction.TYPE_FAVORITE
-        }) is not None
-
     @staticmethod
     def add_favorite(user_id, medicine_id):
         """Ajoute un médicament aux favoris d'un utilisateur"""
@@ -506,22 +546,24 @@ class Interaction:
     @staticmethod
     def get_user_favorites(user_id):
         """Récupère tous les médicaments favoris d'un utilisateur"""
-        favorites = list(mongo.db.interactions.find(
-            {"user_id": user_id, "type": "favorite"}
-        ).sort("created_at", -1))
-        
-        # Récupérer les détails des médicaments pour chaque favori
-        medicine_ids = [ObjectId(fav["medicine_id"]) for fav in favorites]
-        medicines = list(mongo.db.medicines.find({"_id": {"$in": medicine_ids}}))
-        
-        # Organiser les médicaments sous forme de dictionnaire pour un accès facile
-        medicines_dict = {str(med["_id"]): med for med in medicines}
-        
-        # Ajouter les détails des médicaments aux favoris
-        for favorite in favorites:
-            med_id = favorite["medicine_id"]
-            if med_id in medicines_dict:
-                favorite["medicine"] = medicines_dict[med_id]
+        # Favoris et détails des médicaments joints par MongoDB ($lookup sur l'index _id), en une requête
+        favorites = list(mongo.db.interactions.aggregate([
+            {"$match": {"user_id": user_id, "type": "favorite"}},
+            {"$sort": {"created_at": -1}},
+            # ID de médicament invalide : pas de jointure plutôt qu'une erreur
+            {"$addFields": {"_medicine_oid": {"$convert": {
+                "input": "$medicine_id", "to": "objectId", "onError": None, "onNull": None
+            }}}},
+            {"$lookup": {
+                "from": "medicines",
+                "localField": "_medicine_oid",
+                "foreignField": "_id",
+                "as": "medicine"
+            }},
+            # Champ "medicine" absent si le médicament n'existe plus
+            {"$unwind": {"path": "$medicine", "preserveNullAndEmptyArrays": True}},
+            {"$project": {"_medicine_oid": 0}}
+        ]))
         
         return favorites
 
@@ -566,12 +608,15 @@ def init_db(app):
         # Index on user emails (unique)
         mongo.db.users.create_index("email", unique=True)
         
-        # Index on comments for efficient search
+        # Index on comments for efficient search: only published comments are ever read,
+        # newest first (the sort is served by the index, visibility is checked on the few matches)
         mongo.db.comments.create_index([
             ("medicine_id", 1),
-            ("status", 1),
-            ("visibility", 1)
-        ])
+            ("timestamp", -1)
+        ], partialFilterExpression={"status": Comment.STATUS_PUBLISHED})
+        # Former full index, replaced by the partial one above
+        if "medicine_id_1_status_1_visibility_1" in mongo.db.comments.index_information():
+            mongo.db.comments.drop_index("medicine_id_1_status_1_visibility_1")
         
         # Index on interactions
         mongo.db.interactions.create_index([
@@ -579,3 +624,10 @@ def init_db(app):
             ("medicine_id", 1),
             ("type", 1)
         ], unique=True)
+        
+        # Index on a user's favorites, newest first (favorites page)
+        mongo.db.interactions.create_index([
+            ("user_id", 1),
+            ("type", 1),
+            ("created_at", -1)
+        ])
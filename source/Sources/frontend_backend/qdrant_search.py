@@ -6,31 +6,74 @@ Avec hybrid search, re-ranking, caching, et optimisations avancées
 """
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from sentence_transformers import SentenceTransformer
+from qdrant_client.models import (
+    Filter, FieldCondition, MatchValue, MatchText, TextIndexParams, TokenizerType,
+    Prefetch, FusionQuery, Fusion, SearchParams, QuantizationSearchParams, QueryRequest
+)
+from fastembed import TextEmbedding
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
 from functools import lru_cache
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import hashlib
+import numpy as np
 import time
 
 load_dotenv()
 
+# Modèle utilisé pour indexer medicaments_mistral (scripts/index_to_qdrant.py), en version ONNX
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Recherche sur la quantification int8 de la collection (scripts/enable_qdrant_quantization.py)
+QUANTIZATION_PARAMS = QuantizationSearchParams(rescore=True, oversampling=2.0)
+
+# Champs du payload lus par _format_result : les autres ne sont pas transférés
+RESULT_PAYLOAD_FIELDS = [
+    "nom", "nom_lc", "composition", "posologie", "indications",
+    "effets_secondaires", "contre_indications", "interactions", "url"
+]
+
+# Requêtes courtes (souvent un nom de médicament) : recherche restreinte aux noms correspondants
+SHORT_QUERY_MAX_WORDS = 2
+
+@lru_cache(maxsize=None)
+def _load_embedding_model(model_id: str) -> TextEmbedding:
+    """Modèle FastEmbed chargé une seule fois par processus"""
+    return TextEmbedding(model_id)
+
+@lru_cache(maxsize=4096)
+def _embed(model_id: str, text: str) -> np.ndarray:
+    """
+    Embedding d'une requête, mis en cache au niveau du module (clé : modèle et texte) :
+    partagé entre les instances et sans garder d'instance en mémoire.
+    """
+    vector = next(iter(_load_embedding_model(model_id).query_embed([text]))).astype(np.float32)
+    # Tableau partagé par tous les appels : lecture seule
+    vector.setflags(write=False)
+    return vector
+
 class QdrantMedicSearchV2:
     """Classe pour gérer les recherches dans Qdrant avec optimisations avancées"""
     
-    def __init__(self, qdrant_host="localhost", qdrant_port=6333):
+    # Largeur de parcours HNSW (ef) par type de recherche : plus de précision là où
+    # les candidats sont sur-échantillonnés puis re-classés
+    SEMANTIC_SEARCH_PARAMS = SearchParams(hnsw_ef=128, quantization=QUANTIZATION_PARAMS)
+    HYBRID_PREFETCH_PARAMS = SearchParams(hnsw_ef=256)
+    
+    def __init__(self, qdrant_host="localhost", qdrant_port=6333, qdrant_grpc_port=6334):
         try:
-            self.qdrant = QdrantClient(qdrant_host, port=qdrant_port)
-            # Modèle d'embedding plus puissant (384 dimensions vs 384 pour L6)
-            self.embedding_model = SentenceTransformer("all-mpnet-base-v2")
+            # gRPC : requêtes groupées (query_batch_points) traitées en parallèle côté serveur
+            self.qdrant = QdrantClient(qdrant_host, port=qdrant_port, grpc_port=qdrant_grpc_port, prefer_grpc=True)
+            # Même modèle que l'indexation de la collection (384 dimensions), exécuté par
+            # FastEmbed (ONNX Runtime, sans PyTorch)
+            self.model_id = EMBEDDING_MODEL
+            self.embedding_model = _load_embedding_model(self.model_id)
             self.collection_name = "medicaments_mistral"
             self.available = True
             
-            # Cache pour les embeddings (évite de recalculer les mêmes)
-            self.embedding_cache = {}
+            # Index texte (préfixes des mots, minuscules) sur le nom : autocomplete et recherche hybride
+            self._ensure_name_index()
             
             # Stats
             self.stats = self._get_stats()
@@ -40,6 +83,36 @@ class QdrantMedicSearchV2:
             print(f"❌ Erreur connexion Qdrant: {e}")
             self.available = False
     
+    def _ensure_name_index(self):
+        """Crée l'index texte du payload 'nom' utilisé par l'autocomplete et la recherche hybride"""
+        try:
+            self.qdrant.create_payload_index(
+                collection_name=self.collection_name,
+                field_name="nom",
+                field_schema=TextIndexParams(
+                    type="text",
+                    tokenizer=TokenizerType.PREFIX,
+                    lowercase=True,
+                    min_token_len=2,
+                    max_token_len=20
+                )
+            )
+        except Exception as e:
+            print(f"⚠️ Index texte 'nom' non créé: {e}")
+    
+    def _match_names(self, query: str, limit: int):
+        """
+        Points dont le nom contient les mots de la requête (début de mot), filtrés par Qdrant
+        avec l'index texte : seuls les noms correspondants sont transférés (autocomplete).
+        """
+        return self.qdrant.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=Filter(must=[FieldCondition(key="nom", match=MatchText(text=query))]),
+            limit=limit,
+            with_payload=["nom"],
+            with_vectors=False
+        )[0]
+    
     def _get_stats(self):
         """Obtient les stats de la collection"""
         try:
@@ -48,106 +121,104 @@ class QdrantMedicSearchV2:
         except:
             return "Stats indisponibles"
     
-    @lru_cache(maxsize=1000)
-    def _get_embedding_cached(self, text: str) -> List[float]:
+    def _get_embedding_cached(self, text: str) -> np.ndarray:
         """Cache les embeddings pour éviter de recalculer"""
-        return self.embedding_model.encode(text).tolist()
+        return _embed(self.model_id, text)
     
     def _normalize_score(self, score: float) -> float:
         """Normalise les scores entre 0 et 1"""
         # Qdrant retourne des scores cosine (0 à 1 généralement)
         return min(max(score, 0), 1.0)
     
-    def _exact_match_boost(self, query: str, nom: str, base_score: float) -> float:
-        """Boost le score si c'est une correspondance exacte"""
+    def _exact_match_boost(self, query: str, noms: np.ndarray) -> np.ndarray:
+        """Multiplicateurs de score selon la correspondance du nom (exact, commence par, contient)"""
         query_lower = query.lower().strip()
-        nom_lower = nom.lower().strip()
+        noms = np.char.strip(noms)
         
-        if nom_lower == query_lower:
-            return min(base_score * 1.5, 1.0)  # +50% si match exact
-        elif nom_lower.startswith(query_lower):
-            return min(base_score * 1.3, 1.0)  # +30% si commence par
-        elif query_lower in nom_lower:
-            return min(base_score * 1.15, 1.0)  # +15% si contient
-        return base_score
+        return np.select(
+            [noms == query_lower, np.char.startswith(noms, query_lower), np.char.find(noms, query_lower) >= 0],
+            [1.5, 1.3, 1.15],  # +50% si match exact, +30% si commence par, +15% si contient
+            default=1.0
+        )
     
-    def _keyword_relevance_boost(self, query: str, nom: str, indications: str, score: float) -> float:
+    def _keyword_relevance_boost(self, query: str, full_texts: np.ndarray) -> np.ndarray:
         """
-        Boost/pénalise le score selon la pertinence des keywords
+        Multiplicateurs de score selon la pertinence des keywords (nom + indications)
         Moins strict pour éviter de filtrer trop de résultats
         """
         query_words = set(word for word in query.lower().split() if len(word) > 2)
         if not query_words:
-            return score
-            
-        nom_lower = nom.lower()
-        indications_lower = indications.lower() if indications else ""
-        full_text = f"{nom_lower} {indications_lower}"
+            return np.ones(len(full_texts))
         
-        # Chercher les keywords
-        keyword_matches = sum(1 for word in query_words if word in full_text)
-        total_words = len(query_words)
+        # Chercher les keywords : une recherche vectorisée par mot de la requête
+        keyword_matches = sum((np.char.find(full_texts, word) >= 0).astype(np.int32) for word in query_words)
+        ratio = keyword_matches / len(query_words)
         
         # Scoring basé sur keywords - plus souple
-        if total_words == 0:
-            return score
-        elif keyword_matches >= total_words * 0.7:
-            # 70%+ keywords trouvés = excellent
-            return min(score * 1.3, 1.0)
-        elif keyword_matches >= total_words * 0.4:
-            # 40%+ keywords = bon
-            return min(score * 1.1, 1.0)
-        elif keyword_matches > 0:
-            # Quelques keywords = neutre
-            return score
-        else:
-            # Aucun keyword = légère pénalité
-            return score * 0.85
+        # 70%+ keywords trouvés = excellent, 40%+ = bon, quelques-uns = neutre,
+        # aucun = légère pénalité
+        return np.select([ratio >= 0.7, ratio >= 0.4, keyword_matches > 0], [1.3, 1.1, 1.0], default=0.85)
     
-    def _calculate_relevance_score(self, query: str, result: Dict) -> float:
+    def _calculate_relevance_scores(self, query: str, results: List[Dict]) -> np.ndarray:
         """
-        Calcule un score de pertinence multi-critères
+        Calcule les scores de pertinence multi-critères de tous les résultats
         Équilibre entre vectoriel et keywords
         """
-        base_score = result['score']
-        nom = result.get('nom', '')
-        indications = result.get('indications', '')
+        base_scores = np.fromiter((r['score'] for r in results), dtype=np.float64, count=len(results))
+        noms = np.array([r['nom_lc'] for r in results], dtype=str)
+        full_texts = np.array(
+            [f"{nom} {(r.get('indications') or '').lower()}" for nom, r in zip(noms, results)], dtype=str
+        )
         
         # 1. Boost keyword relevance (30% du poids)
-        keyword_boost = self._keyword_relevance_boost(query, nom, indications, 1.0) - 1.0
-        keyword_component = keyword_boost * 0.3
+        keyword_component = (np.minimum(self._keyword_relevance_boost(query, full_texts), 1.0) - 1.0) * 0.3
         
         # 2. Boost exact match (20% du poids)
-        exact_boost = self._exact_match_boost(query, nom, 1.0) - 1.0
-        exact_component = exact_boost * 0.2
+        exact_component = (np.minimum(self._exact_match_boost(query, noms), 1.0) - 1.0) * 0.2
         
         # 3. Score vectoriel de base (45% du poids) - augmenté
-        vector_component = base_score * 0.45
+        vector_component = base_scores * 0.45
         
         # 4. Faible pénalité pour très faibles scores
-        if base_score < 0.2:
-            penalty = 0.08
-        else:
-            penalty = 0
-        penalty_component = penalty * 0.05
+        penalty_component = np.where(base_scores < 0.2, 0.08, 0.0) * 0.05
         
         # Score final normalisé
-        final_score = min(vector_component + keyword_component + exact_component + penalty_component, 1.0)
-        return max(final_score, 0.0)
+        return np.clip(vector_component + keyword_component + exact_component + penalty_component, 0.0, 1.0)
+    
+    def _format_result(self, result, score: float) -> Dict:
+        """Résultat de recherche (point Qdrant) au format renvoyé par les méthodes de recherche"""
+        payload = result.payload or {}
+        return {
+            "id": result.id,
+            "score": score,
+            "nom": payload.get("nom", "N/A"),
+            # Points indexés avant l'ajout de nom_lc : minuscules calculées ici
+            "nom_lc": payload.get("nom_lc") or payload.get("nom", "N/A").lower(),
+            "composition": payload.get("composition", "")[:250],
+            "posologie": payload.get("posologie", "")[:250],
+            "indications": payload.get("indications", "")[:250],
+            "effets_secondaires": payload.get("effets_secondaires", "")[:250],
+            "contre_indications": payload.get("contre_indications", "")[:250],
+            "interactions": payload.get("interactions", "")[:250],
+            "url": payload.get("url", ""),
+            "qdrant_id": result.id
+        }
     
     def _rerank_results(self, query: str, results: List[Dict]) -> List[Dict]:
         """Re-classe les résultats avec scoring multi-critères"""
-        reranked = []
+        if not results:
+            return []
         
-        for result in results:
-            original_score = result['score']
-            relevance_score = self._calculate_relevance_score(query, result)
-            result['score'] = relevance_score
-            result['original_score'] = original_score
+        relevance_scores = self._calculate_relevance_scores(query, results)
+        
+        # Trier par score descendant (tri stable, comme list.sort)
+        reranked = []
+        for i in np.argsort(-relevance_scores, kind="stable"):
+            result = results[i]
+            result['original_score'] = result['score']
+            result['score'] = float(relevance_scores[i])
             reranked.append(result)
         
-        # Trier par score descendant
-        reranked.sort(key=lambda x: x['score'], reverse=True)
         return reranked
     
     def recherche_semantique(self, query: str, limit: int = 20, score_threshold: float = 0.25) -> List[Dict]:
@@ -174,30 +245,34 @@ class QdrantMedicSearchV2:
             query_vector = self._get_embedding_cached(enriched_query)
             
             # 2. Recherche vectorielle - récupérer plus de résultats pour le re-ranking
-            search_results = self.qdrant.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=limit * 3  # Récupérer 3x plus pour filtrer les meilleurs
-            )
+            search_results = []
+            if len(query.split()) <= SHORT_QUERY_MAX_WORDS:
+                # Requête courte : seuls les points dont le nom correspond (index texte) sont
+                # parcourus, moins de candidats à re-classer
+                search_results = self.qdrant.query_points(
+                    collection_name=self.collection_name,
+                    query=query_vector,
+                    query_filter=Filter(must=[FieldCondition(key="nom", match=MatchText(text=query.lower()))]),
+                    limit=limit * 3 // 2,
+                    with_payload=RESULT_PAYLOAD_FIELDS,
+                    search_params=self.SEMANTIC_SEARCH_PARAMS
+                ).points
+            
+            # Aucun nom correspondant (ou requête longue) : recherche sur toute la collection
+            if not search_results:
+                search_results = self.qdrant.query_points(
+                    collection_name=self.collection_name,
+                    query=query_vector,
+                    limit=limit * 3,  # Récupérer 3x plus pour filtrer les meilleurs
+                    with_payload=RESULT_PAYLOAD_FIELDS,
+                    # Parcours sur les vecteurs int8, puis re-score des meilleurs candidats en float32
+                    search_params=self.SEMANTIC_SEARCH_PARAMS
+                ).points
             
             # 3. Extraire et formatter les résultats
             results = []
             for result in search_results:
-                payload = result.payload or {}
-                
-                result_dict = {
-                    "id": result.id,
-                    "score": self._normalize_score(result.score),
-                    "nom": payload.get("nom", "N/A"),
-                    "composition": payload.get("composition", "")[:250],
-                    "posologie": payload.get("posologie", "")[:250],
-                    "indications": payload.get("indications", "")[:250],
-                    "effets_secondaires": payload.get("effets_secondaires", "")[:250],
-                    "contre_indications": payload.get("contre_indications", "")[:250],
-                    "interactions": payload.get("interactions", "")[:250],
-                    "url": payload.get("url", ""),
-                    "qdrant_id": result.id
-                }
+                result_dict = self._format_result(result, self._normalize_score(result.score))
                 
                 # Filtrer par score minimum SEULEMENT si score < 0.15 (très faible)
                 # Laisser passer les résultats 0.15+ pour le re-ranking
@@ -219,78 +294,38 @@ class QdrantMedicSearchV2:
     
     def hybrid_search(self, query: str, limit: int = 20) -> List[Dict]:
         """
-        Recherche hybride optimisée: vectorielle + exacte + fuzzy matching
+        Recherche hybride optimisée: vectorielle + correspondance sur le nom, fusion RRF
         Meilleur pour les requêtes précises (noms de médicaments)
         """
         if not self.available or not query:
             return []
         
         try:
-            query_lower = query.lower().strip()
-            
-            # 1. Recherche vectorielle
-            vector_results = self.recherche_semantique(query, limit=limit * 2, score_threshold=0)
+            query = query.strip()
+            # Les Prefetch (modèles pydantic) attendent une liste de floats
+            query_vector = self._get_embedding_cached(f"medicament: {query}").tolist()
             
-            # 2. Recherche par correspondance exacte et fuzzy
-            all_docs = self.qdrant.scroll(
+            # Une seule requête : candidats vectoriels et candidats dont le nom contient la requête
+            # (index texte), fusionnés par Qdrant (Reciprocal Rank Fusion) avant l'envoi des payloads
+            results = self.qdrant.query_points(
                 collection_name=self.collection_name,
-                limit=2000,
-                with_payload=True,
+                prefetch=[
+                    Prefetch(query=query_vector, params=self.HYBRID_PREFETCH_PARAMS, limit=limit * 3),
+                    Prefetch(
+                        query=query_vector,
+                        filter=Filter(must=[FieldCondition(key="nom", match=MatchText(text=query.lower()))]),
+                        params=self.HYBRID_PREFETCH_PARAMS,
+                        limit=limit * 3
+                    ),
+                ],
+                query=FusionQuery(fusion=Fusion.RRF),
+                limit=limit,
+                with_payload=RESULT_PAYLOAD_FIELDS,
                 with_vectors=False
-            )[0]
+            ).points
             
-            name_matches = []
-            for doc in all_docs:
-                nom = doc.payload.get("nom", "").lower()
-                
-                # Scoring pour correspondance de nom
-                if query_lower == nom:
-                    score = 1.0  # Match exact
-                elif nom.startswith(query_lower):
-                    score = 0.95  # Commence par
-                elif query_lower in nom:
-                    score = 0.85  # Contient
-                else:
-                    # Fuzzy matching simple: compter les caractères qui matchent
-                    matching_chars = sum(1 for c in query_lower if c in nom)
-                    score = (matching_chars / len(query_lower)) * 0.6 if query_lower else 0
-                
-                # Ne garder que les scores significatifs
-                if score >= 0.5:
-                    name_matches.append({
-                        "id": doc.id,
-                        "score": score,
-                        "nom": doc.payload.get("nom", ""),
-                        "is_name_match": True,
-                        "qdrant_id": doc.id
-                    })
-            
-            # 3. Fusionner vectoriel + nom avec poids intelligents
-            combined = {}
-            
-            # Ajouter les matchs de nom (haute priorité)
-            for result in name_matches:
-                key = result["id"]
-                combined[key] = result
-            
-            # Fusionner avec vectoriel
-            for result in vector_results:
-                key = result["id"]
-                if key in combined:
-                    # Combiner les scores: priorité au match de nom (60%) + vectoriel (40%)
-                    combined[key]["score"] = combined[key]["score"] * 0.6 + result["score"] * 0.4
-                    combined[key].update({k: v for k, v in result.items() if k != "score"})
-                else:
-                    combined[key] = result
-            
-            # 4. Trier par score descendant
-            final_results = sorted(
-                combined.values(),
-                key=lambda x: x["score"],
-                reverse=True
-            )
-            
-            return final_results[:limit]
+            # Score RRF : sert au classement, pas comparable aux scores cosinus
+            return [self._format_result(result, result.score) for result in results]
             
         except Exception as e:
             print(f"❌ Erreur hybrid search: {e}")
@@ -319,26 +354,67 @@ class QdrantMedicSearchV2:
             results = self.qdrant.search(
                 collection_name=self.collection_name,
                 query_vector=query_vector,
-                limit=limit
+                limit=limit,
+                with_payload=["nom", field_name]
             )
             
-            formatted_results = []
-            for result in results:
-                payload = result.payload or {}
-                formatted_results.append({
-                    "id": result.id,
-                    "score": self._normalize_score(result.score),
-                    "nom": payload.get("nom", ""),
-                    field_name: payload.get(field_name, "")[:400],
-                    "qdrant_id": result.id
-                })
-            
-            return formatted_results
+            return [self._format_field_result(result, field_name) for result in results]
             
         except Exception as e:
             print(f"❌ Erreur recherche champ: {e}")
             return []
     
+    def recherche_par_champ_batch(self, pairs: List[Tuple[str, str]], limit: int = 20) -> List[List[Dict]]:
+        """
+        Plusieurs recherches par champ en un seul appel (composition, posologie, effets...)
+        
+        Args:
+            pairs: Liste de (field_name, query)
+            limit: Nombre de résultats par recherche
+        
+        Returns:
+            Une liste de résultats par couple, dans l'ordre de pairs
+        """
+        if not self.available or not pairs:
+            return [[] for _ in pairs]
+        
+        try:
+            # Un seul passage du modèle pour toutes les requêtes enrichies
+            enriched_queries = [f"{field_name}: {query}" for field_name, query in pairs]
+            query_vectors = [
+                vector.tolist()
+                for vector in self.embedding_model.query_embed(enriched_queries, batch_size=len(enriched_queries))
+            ]
+            
+            # Un seul aller-retour réseau pour toutes les recherches
+            responses = self.qdrant.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[
+                    QueryRequest(query=query_vector, limit=limit, with_payload=["nom", field_name])
+                    for query_vector, (field_name, _) in zip(query_vectors, pairs)
+                ]
+            )
+            
+            return [
+                [self._format_field_result(result, field_name) for result in response.points]
+                for (field_name, _), response in zip(pairs, responses)
+            ]
+            
+        except Exception as e:
+            print(f"❌ Erreur recherche champ (batch): {e}")
+            return [[] for _ in pairs]
+    
+    def _format_field_result(self, result, field_name: str) -> Dict:
+        """Résultat d'une recherche par champ : nom et extrait du champ recherché"""
+        payload = result.payload or {}
+        return {
+            "id": result.id,
+            "score": self._normalize_score(result.score),
+            "nom": payload.get("nom", ""),
+            field_name: payload.get(field_name, "")[:400],
+            "qdrant_id": result.id
+        }
+    
     def recherche_autocomplete(self, query: str, limit: int = 10) -> List[Dict]:
         """
         Autocomplete pour les noms de médicaments
@@ -349,22 +425,15 @@ class QdrantMedicSearchV2:
         
         try:
             query_lower = query.lower()
-            all_docs = self.qdrant.scroll(
-                collection_name=self.collection_name,
-                limit=5000,
-                with_payload=True,
-                with_vectors=False
-            )[0]
             
             suggestions = []
-            for doc in all_docs:
+            for doc in self._match_names(query_lower, limit * 3):
                 nom = doc.payload.get("nom", "")
-                if query_lower in nom.lower():
-                    suggestions.append({
-                        "id": doc.id,
-                        "nom": nom,
-                        "qdrant_id": doc.id
-                    })
+                suggestions.append({
+                    "id": doc.id,
+                    "nom": nom,
+                    "qdrant_id": doc.id
+                })
             
             # Trier: exact match d'abord, puis commence par, puis contient
             def sort_key(item):
@@ -444,16 +513,16 @@ class QdrantMedicSearchV2:
     
     def get_embedding_cache_stats(self) -> Dict:
         """Retourne les stats du cache d'embeddings"""
-        info = self.embedding_cache.copy()
+        info = _embed.cache_info()
         return {
-            "cache_size": len(self.embedding_cache),
-            "cached_queries": list(self.embedding_cache.keys())[:10]
+            "cache_size": info.currsize,
+            "hits": info.hits,
+            "misses": info.misses
         }
     
     def clear_embedding_cache(self):
         """Vide le cache d'embeddings"""
-        self.embedding_cache.clear()
-        self._get_embedding_cached.cache_clear()
+        _embed.cache_clear()
         print("✅ Cache d'embeddings vidé")
     
     def statistiques(self) -> Dict:
@@ -467,7 +536,7 @@ class QdrantMedicSearchV2:
                 "nombre_documents": info.points_count,
                 "vecteurs_dimension": info.config.params.vectors.size,
                 "distance_metric": info.config.params.vectors.distance.name,
-                "modele_embedding": "all-mpnet-base-v2",
+                "modele_embedding": EMBEDDING_MODEL,
                 "features": ["hybrid_search", "re_ranking", "caching", "autocomplete", "advanced_filters"]
             }
         except Exception as e:
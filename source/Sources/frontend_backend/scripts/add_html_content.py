@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Migration unique : ajoute le champ html_content aux éléments de contenu des médicaments déjà en base
+Les nouveaux documents le reçoivent directement depuis scripts/scraper.py
+"""
+
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer les modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pymongo import MongoClient, UpdateOne
+from scripts.scraper import add_html_content
+
+MONGO_URI = "mongodb://localhost:27017/"  # Utilise localhost depuis la machine hôte
+BATCH_SIZE = 500
+
+def migrate(collection_name):
+    """Calcule html_content pour chaque texte des sections de tous les documents de la collection"""
+    client = MongoClient(MONGO_URI)
+    collection = client['medicsearch'][collection_name]
+    
+    print(f"🔄 Migration de '{collection_name}'...")
+    updated = 0
+    batch = []
+    for doc in collection.find({'sections': {'$exists': True}}, {'sections': 1}):
+        add_html_content(doc)
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': {'sections': doc['sections']}}))
+        if len(batch) >= BATCH_SIZE:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    
+    print(f"✅ {updated} documents mis à jour dans '{collection_name}'")
+    client.close()
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or ['medic_mistral', 'medicines']:
+        migrate(name)
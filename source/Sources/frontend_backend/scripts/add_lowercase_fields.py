@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Migration unique : ajoute les champs *_lc (minuscules précalculées) aux médicaments déjà en base
+Les nouveaux documents les reçoivent directement depuis scripts/scraper.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer les modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pymongo import MongoClient, UpdateOne
+from scripts.scraper import add_lowercase_fields
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')  # localhost depuis la machine hôte par défaut
+BATCH_SIZE = 500
+
+def migrate(collection_name):
+    """Ajoute title_lc, sections.title_lc, content.text_lc et medicine_details_lc à tous les documents de la collection"""
+    client = MongoClient(MONGO_URI)
+    collection = client['medicsearch'][collection_name]
+    
+    print(f"🔄 Migration de '{collection_name}'...")
+    updated = 0
+    batch = []
+    for doc in collection.find({}, {'title': 1, 'sections': 1, 'medicine_details': 1}):
+        add_lowercase_fields(doc)
+        fields = {'title_lc': doc['title_lc'], 'medicine_details_lc': doc['medicine_details_lc']}
+        if 'sections' in doc:
+            fields['sections'] = doc['sections']
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': fields}))
+        if len(batch) >= BATCH_SIZE:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    
+    print(f"✅ {updated} documents mis à jour dans '{collection_name}'")
+    client.close()
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or ['medic_mistral', 'medicines']:
+        migrate(name)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Migration unique : ajoute le champ nom_lc (nom en minuscules) aux points Qdrant déjà indexés
+Les nouveaux points le reçoivent directement depuis scripts/index_to_qdrant.py
+"""
+
+import sys
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import SetPayload, SetPayloadOperation
+
+QDRANT_HOST = "localhost"  # Utilise localhost depuis la machine hôte
+QDRANT_PORT = 6333
+BATCH_SIZE = 500
+
+def migrate(collection_name):
+    """Ajoute nom_lc à tous les points de la collection, une requête groupée par page de scroll"""
+    client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT)
+    
+    print(f"🔄 Migration de '{collection_name}'...")
+    updated = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=BATCH_SIZE,
+            offset=offset,
+            with_payload=["nom"],
+            with_vectors=False
+        )
+        if points:
+            client.batch_update_points(
+                collection_name=collection_name,
+                update_operations=[
+                    SetPayloadOperation(set_payload=SetPayload(
+                        payload={"nom_lc": (point.payload or {}).get("nom", "").lower()},
+                        points=[point.id]
+                    ))
+                    for point in points
+                ]
+            )
+            updated += len(points)
+        if offset is None:
+            break
+    
+    print(f"✅ {updated} points mis à jour dans '{collection_name}'")
+    client.close()
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or ['medicaments_mistral']:
+        migrate(name)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Migration unique : ajoute le champ update_date_key (AAAAMMJJ) aux médicaments déjà en base
+Les nouveaux documents le reçoivent directement depuis scripts/scraper.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer les modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pymongo import MongoClient, UpdateOne
+from scripts.scraper import french_date_key
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')  # localhost depuis la machine hôte par défaut
+BATCH_SIZE = 1000
+
+def migrate(collection_name):
+    """Calcule update_date_key à partir de update_date pour tous les documents de la collection"""
+    client = MongoClient(MONGO_URI)
+    collection = client['medicsearch'][collection_name]
+    
+    print(f"🔄 Migration de '{collection_name}'...")
+    updated = 0
+    batch = []
+    for doc in collection.find({}, {'update_date': 1}):
+        batch.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'update_date_key': french_date_key(doc.get('update_date'))}}
+        ))
+        if len(batch) >= BATCH_SIZE:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    
+    collection.create_index('update_date_key')
+    print(f"✅ {updated} documents mis à jour dans '{collection_name}'")
+    client.close()
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or ['medic_mistral', 'medicines']:
+        migrate(name)
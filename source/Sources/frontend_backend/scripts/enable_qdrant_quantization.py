@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Migration unique : active la quantification scalaire int8 sur une collection Qdrant existante
+Les nouvelles collections sont créées avec (scripts/index_to_qdrant.py, traiter_mistral.py)
+"""
+
+import sys
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import ScalarQuantization, ScalarQuantizationConfig, ScalarType
+
+QDRANT_HOST = "localhost"  # Utilise localhost depuis la machine hôte
+QDRANT_PORT = 6333
+
+def migrate(collection_name):
+    """Ajoute une copie int8 des vecteurs, gardée en RAM ; Qdrant la construit en arrière-plan"""
+    client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT)
+    
+    print(f"🔄 Quantification de '{collection_name}'...")
+    client.update_collection(
+        collection_name=collection_name,
+        quantization_config=ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    )
+    print(f"✅ Quantification int8 activée pour '{collection_name}'")
+    client.close()
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or ['medicaments_mistral']:
+        migrate(name)
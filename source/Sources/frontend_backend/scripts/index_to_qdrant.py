@@ -7,7 +7,9 @@ Utilise la collection 'medic_mistral' de MongoDB contenant les données structur
 
 from pymongo import MongoClient
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, VectorParams, Distance
+from qdrant_client.models import (
+    PointStruct, VectorParams, Distance, ScalarQuantization, ScalarQuantizationConfig, ScalarType
+)
 from sentence_transformers import SentenceTransformer
 import uuid
 import os
@@ -42,7 +44,11 @@ try:
         print("📝 Création de la collection 'medicaments_mistral'...")
         qdrant.create_collection(
             collection_name="medicaments_mistral",
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            vectors_config=VectorParams(size=384, distance=Distance.COSINE),
+            # Copie int8 des vecteurs en RAM pour la recherche (4x moins de mémoire parcourue)
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
         )
         print("✅ Collection créée")
     else:
@@ -103,6 +109,8 @@ try:
                 vector=embedding,
                 payload={
                     "nom": doc.get("nom", ""),
+                    # Minuscules précalculées pour le re-classement (qdrant_search.py)
+                    "nom_lc": doc.get("nom", "").lower(),
                     "mongo_id": str(mongo_id),
                     "posologie": doc.get("posologie", "")[:500],
                     "effets_secondaires": doc.get("effets_secondaires", "")[:500],
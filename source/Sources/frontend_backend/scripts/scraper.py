@@ -8,6 +8,7 @@ import hashlib
 import os
 import time
 from bson.objectid import ObjectId
+from markupsafe import Markup, escape
 
 # Variables globales pour le suivi de l'état
 is_running = False
@@ -281,6 +282,13 @@ def run_scraper(db_connection=None, source_file=None, max_urls=None):
                 content_hash = generate_content_hash(document)
                 document["content_hash"] = content_hash
                 
+                # Versions en minuscules précalculées pour le classement des résultats de recherche
+                add_lowercase_fields(document)
+                # Rendu HTML des textes, calculé une fois ici plutôt qu'à chaque affichage
+                add_html_content(document)
+                # Clé numérique AAAAMMJJ pour trier par date côté MongoDB
+                document["update_date_key"] = french_date_key(update_date)
+                
                 # Vérifier si le médicament existe déjà
                 existing = collection.find_one({"url": url})
                 
@@ -402,6 +410,58 @@ def generate_content_hash(document):
     )
     return hashlib.md5(content_string.encode('utf-8')).hexdigest()
 
+def french_date_key(date_str):
+    """Convertit une date française JJ/MM/AAAA en clé de tri AAAAMMJJ (0 si invalide)"""
+    if not date_str or not isinstance(date_str, str) or '/' not in date_str:
+        return 0
+    try:
+        day, month, year = map(int, date_str.split('/'))
+    except ValueError:
+        return 0
+    return year * 10000 + month * 100 + day
+
+def add_html_content(document):
+    """
+    Ajoute le champ html_content (texte échappé, sauts de ligne en <br>) à chaque élément
+    de contenu des sections et sous-sections qui n'en a pas encore.
+    """
+    def render_sections(sections):
+        for section in sections:
+            for content_item in section.get("content", []):
+                if content_item.get("text") is not None and "html_content" not in content_item:
+                    html_text = escape(content_item["text"]).replace("\n", Markup("<br>"))
+                    content_item["html_content"] = str(Markup("<p>{}</p>").format(html_text))
+            render_sections(section.get("subsections", []))
+    
+    render_sections(document.get("sections", []))
+    return document
+
+def add_lowercase_fields(document):
+    """
+    Ajoute les champs *_lc (titre, titres de sections, textes et détails en minuscules)
+    pour éviter de recalculer str.lower() à chaque recherche.
+    """
+    def lowercase_sections(sections):
+        for section in sections:
+            section["title_lc"] = section.get("title", "").lower()
+            for content_item in section.get("content", []):
+                if "text" in content_item:
+                    content_item["text_lc"] = (content_item["text"] or "").lower()
+            lowercase_sections(section.get("subsections", []))
+    
+    document["title_lc"] = (document.get("title") or "").lower()
+    lowercase_sections(document.get("sections", []))
+    
+    # Champs des filtres de recherche, interrogés par regex ancrée sensible à la casse (indexable)
+    details = document.get("medicine_details") or {}
+    document["medicine_details_lc"] = {
+        "substances_actives": [str(v).lower() for v in details.get("substances_actives") or [] if v],
+        "forme": (details.get("forme") or "").lower(),
+        "laboratoire": (details.get("laboratoire") or "").lower(),
+        "dosages": [str(v).lower() for v in details.get("dosages") or [] if v],
+    }
+    return document
+
 def extract_update_date(soup):
     """Extrait la date de mise à jour du document"""
     update_date = "Date not found"
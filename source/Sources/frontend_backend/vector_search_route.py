@@ -7,19 +7,73 @@ Route de recherche vectorielle pour Flask
 
 from flask import Blueprint, request, jsonify, render_template
 from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
 from bson.objectid import ObjectId
+from functools import lru_cache
+from pymongo import WriteConcern
+import numpy as np
+import hashlib
 import os
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 # Configuration
 load_dotenv()
 QDRANT_HOST = os.getenv('QDRANT_HOST', 'qdrant')
 QDRANT_PORT = int(os.getenv('QDRANT_PORT', 6333))
+QDRANT_GRPC_PORT = int(os.getenv('QDRANT_GRPC_PORT', 6334))
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Embeddings des requêtes conservés entre les redémarrages (le cache lru_cache repart à vide)
+EMBEDDING_CACHE_COLLECTION = "embedding_cache"
+# Durée de conservation d'un embedding en base (index TTL sur ts)
+EMBEDDING_CACHE_TTL = 30 * 24 * 3600
 
-# Clients
-qdrant_client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT)
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# Clients (gRPC : sérialisation plus légère que REST/JSON pour les vecteurs et payloads ;
+# un seul client persistant, partagé avec app.py)
+qdrant_client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
+
+@lru_cache(maxsize=1)
+def get_embedding_model():
+    """Charge le modèle d'embedding au premier usage (partagé avec app.py)"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+def embed_query(text):
+    """
+    Embedding d'une requête, mis en cache : le modèle est insensible à la casse,
+    donc la requête est normalisée (minuscules, espaces) avant de servir de clé.
+    """
+    return list(_embed_normalized(" ".join(text.lower().split())))
+
+@lru_cache(maxsize=10000)
+def _embed_normalized(text):
+    # Tuple immuable : une même entrée du cache est partagée entre les appels.
+    # Cache en mémoire devant le cache MongoDB persistant : une lecture par _id ne coûte
+    # qu'un aller-retour local, bien moins qu'un encodage par le modèle
+    key = hashlib.sha256(f"{EMBEDDING_MODEL}|{text}".encode()).digest()
+    if embedding_cache is not None:
+        try:
+            cached = embedding_cache.find_one({"_id": key}, {"vector": 1})
+            if cached is not None:
+                return tuple(np.frombuffer(cached["vector"], dtype=np.float16).astype(np.float32).tolist())
+        except Exception as e:
+            print(f"⚠️ Cache d'embeddings indisponible: {e}")
+    
+    vector = get_embedding_model().encode(text, normalize_embeddings=True)
+    if embedding_cache is not None:
+        try:
+            # float16 : moitié moins de place, précision suffisante pour la similarité cosinus ;
+            # écriture sans accusé de réception, la requête n'attend pas le cache
+            embedding_cache.with_options(write_concern=WriteConcern(w=0)).update_one(
+                {"_id": key},
+                {"$setOnInsert": {
+                    "vector": vector.astype(np.float16).tobytes(),
+                    "ts": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"⚠️ Cache d'embeddings indisponible: {e}")
+    return tuple(vector.tolist())
 
 # Blueprint
 vector_search_bp = Blueprint('vector_search', __name__)
@@ -27,19 +81,26 @@ vector_search_bp = Blueprint('vector_search', __name__)
 # Note: medicines_collection sera passé dynamiquement par app.py
 # Voir app.py register_vector_search_blueprint()
 medicines_collection = None
+embedding_cache = None
 
 def register_vector_search_blueprint(app, medicines_coll):
     """Enregistrer le blueprint avec la collection MongoDB"""
-    global medicines_collection
+    global medicines_collection, embedding_cache
     medicines_collection = medicines_coll
+    embedding_cache = medicines_coll.database[EMBEDDING_CACHE_COLLECTION]
+    try:
+        embedding_cache.create_index("ts", expireAfterSeconds=EMBEDDING_CACHE_TTL)
+        # Entrées écrites sans date : datées maintenant pour qu'elles expirent aussi
+        embedding_cache.update_many({"ts": {"$exists": False}}, {"$currentDate": {"ts": True}})
+    except Exception as e:
+        print(f"⚠️ Index TTL du cache d'embeddings non créé: {e}")
     app.register_blueprint(vector_search_bp)
     print(f"🔗 Vector search blueprint registered with MongoDB collection", flush=True)
 
 
 def create_id(text):
-    """Génère un ID unique basé sur le hash"""
-    import hashlib
-    return int(hashlib.md5(text.encode()).hexdigest(), 16) % (2**63 - 1)
+    """Génère un ID unique basé sur le hash (identique à IndexerAmeliore.create_id)"""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
 
 
 def get_medicine_by_id(qdrant_id):
@@ -65,7 +126,7 @@ def vector_search():
     if query:
         try:
             # Encoder la requête
-            query_vector = embedding_model.encode(query).tolist()
+            query_vector = embed_query(query)
             
             # Chercher dans Qdrant
             search_results = qdrant_client.query_points(
@@ -151,7 +212,7 @@ def api_vector_search():
             return jsonify({'error': 'Query required'}), 400
         
         # Encoder la requête
-        query_vector = embedding_model.encode(query).tolist()
+        query_vector = embed_query(query)
         
         # Chercher dans Qdrant
         search_results = qdrant_client.query_points(